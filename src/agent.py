@@ -1,26 +1,96 @@
+import asyncio
+import itertools
 import json
-from typing import override
+import time
+from typing import override, Optional, Literal
 
 import dotenv
 from ichatbio.agent import IChatBioAgent
 from ichatbio.agent_response import ResponseContext, IChatBioAgentProcess
 from ichatbio.server import build_agent_app
 from ichatbio.types import AgentCard, AgentEntrypoint, Artifact
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from starlette.applications import Starlette
 
 from plot import (
     select_properties,
     PropertyPaths,
     GiveUp,
-    read_path,
-    render_points_as_geojson,
+    read_raw_path,
+    read_coordinate_pairs,
+    iter_features,
 )
-from util import retrieve_artifact_content, extract_json_schema
+from coalesce import SingleFlight, SharedProcess
+from colors import Legend, encode_color_values
+from coordinates import ParseReport
+from deadline import Deadline, time_budget_from_env
+from memory import (
+    MemoryBudget,
+    MemoryBudgetExceeded,
+    FloatColumn,
+    SpillBuffer,
+    write_feature_collection,
+)
+from output import (
+    CoordinateSizes,
+    output_options_from_env,
+    quantize_coordinates,
+    quantization_transform,
+    encoded_writer,
+)
+from spatial import BoundingBox, FilterReport, Polygon, filter_points
+from util import retrieve_artifact_content, extract_json_schema, schema_fingerprint
 
 
 class Parameters(BaseModel):
     artifact: Artifact
+    previous_map: Optional[Artifact] = Field(
+        None,
+        description="A map previously generated by this agent for an earlier page of the same data. If the new "
+        "artifact has the same schema, its points are added to that map.",
+    )
+    region: Optional[BoundingBox | Polygon] = Field(
+        None,
+        description="Only map points inside this region, e.g. a bounding box around a country. Longitudes and "
+        "latitudes are in degrees.",
+    )
+    incremental_output: Literal["append", "delta"] = Field(
+        "append",
+        description='With a previous map, "append" produces a map with the old and new points, while "delta" '
+        "produces a map with only the new points.",
+    )
+
+
+class MapResult(BaseModel):
+    """The outcome of a plot request, shared by every caller that made the same request at the same time."""
+
+    content: bytes
+    metadata: dict
+    incremental_output: Optional[Literal["append", "delta"]]
+    """How the map continues a previous map, if it does."""
+    encode_seconds: float
+
+
+def request_key(request: str, entrypoint: str, params: Parameters) -> str:
+    """
+    Identifies requests that would produce the same map. Artifacts are identified by their URIs and metadata rather
+    than their conversation-local IDs, so the same artifact shared in different conversations still matches.
+    """
+
+    def artifact_key(artifact: Optional[Artifact]):
+        if artifact is None:
+            return None
+        return {"uris": artifact.uris, "metadata": artifact.metadata}
+
+    normalized = params.model_dump(mode="json", exclude={"artifact", "previous_map"})
+    normalized |= {
+        "artifact": artifact_key(params.artifact),
+        "previous_map": artifact_key(params.previous_map),
+    }
+    return json.dumps(
+        [entrypoint, " ".join(request.split()).casefold(), normalized],
+        sort_keys=True,
+    )
 
 
 class MapAgent(IChatBioAgent):
@@ -44,6 +114,9 @@ class MapAgent(IChatBioAgent):
             ],
         )
 
+    def __init__(self):
+        self.single_flight: SingleFlight[Optional[MapResult]] = SingleFlight()
+
     @override
     async def run(
         self,
@@ -56,44 +129,256 @@ class MapAgent(IChatBioAgent):
         async with context.begin_process(summary="Creating map data") as process:
             process: IChatBioAgentProcess
 
-            content = await retrieve_artifact_content(params.artifact, process)
-            schema = extract_json_schema(content)
-
-            match await select_properties(request, schema):
-                case PropertyPaths() as paths:
-                    # TODO: do all of these at the same time to ensure alignment
-                    await process.log(
-                        "Using the following property paths",
-                        data={
-                            "latitude": paths.latitude,
-                            "longitude": paths.longitude,
-                            "color_by": paths.color_by,
-                        },
-                    )
-                    latitudes = read_path(content, paths.latitude)
-                    longitudes = read_path(content, paths.longitude)
-                    if paths.color_by:
-                        extra_values = read_path(content, paths.color_by)
-                    else:
-                        extra_values = None
-
-                    coords = list(zip(latitudes, longitudes))
-                    geo = render_points_as_geojson(coords, extra_values)
-
-                    await process.create_artifact(
-                        mimetype="application/json",
-                        description=f"GeoJSON points extracted from artifact {params.artifact.local_id}",
-                        content=json.dumps(geo).encode("utf-8"),
-                        metadata={"format": "geojson"},
-                    )
+            # Identical requests that arrive while one is in progress share its work
+            result = await self.single_flight.run(
+                request_key(request, entrypoint, params),
+                lambda shared: self.make_map(request, params, shared),
+                process,
+            )
+            if result is None:
+                return
+
+            description = (
+                f"GeoJSON points extracted from artifact {params.artifact.local_id}"
+            )
+            metadata = dict(result.metadata)
+            if result.incremental_output:
+                previous_id = params.previous_map.local_id
+                match result.incremental_output:
+                    case "append":
+                        description += f", appended to map {previous_id}"
+                    case "delta":
+                        metadata["delta_of"] = previous_id
+                        description += f", continuing map {previous_id}"
+            if metadata.get("partial"):
+                description += " (partial)"
+
+            upload_start = time.perf_counter()
+            await process.create_artifact(
+                mimetype="application/json",
+                description=description,
+                content=result.content,
+                metadata=metadata,
+            )
+            upload_seconds = time.perf_counter() - upload_start
+
+            await process.log(
+                "Uploaded map data",
+                data={
+                    "encode_seconds": result.encode_seconds,
+                    "upload_seconds": upload_seconds,
+                },
+            )
+
+    async def make_map(
+        self, request: str, params: Parameters, process: SharedProcess
+    ) -> Optional[MapResult]:
+        """Does the work for a plot request, up to but not including creating the artifact."""
+        budget = MemoryBudget()
+        deadline = Deadline(time_budget_from_env())
+        try:
+            async with asyncio.timeout(deadline.remaining()):
+                content = await retrieve_artifact_content(
+                    params.artifact, process, budget, deadline
+                )
+        except TimeoutError:
+            await process.log("Ran out of time while retrieving the artifact content")
+            return None
+        except MemoryBudgetExceeded as e:
+            await process.log(f"Artifact is too large to map: {e}")
+            return None
+        schema = extract_json_schema(content)
+        fingerprint = schema_fingerprint(schema)
 
+        paths, start_id = None, 0
+        if params.previous_map:
+            paths, start_id = await continue_map(
+                params.previous_map, fingerprint, process
+            )
+
+        continuing = paths is not None
+        if not continuing:
+            match await select_properties(request, schema, deadline):
+                case PropertyPaths() as selected_paths:
+                    paths = selected_paths
                 case GiveUp(reason=reason):
                     await process.log(f"Failed to generate map parameters: {reason}")
-                    return
+                    return None
+
+        # TODO: do all of these at the same time to ensure alignment
+        await process.log(
+            "Using the following property paths",
+            data={
+                "latitude": paths.latitude,
+                "longitude": paths.longitude,
+                "color_by": paths.color_by,
+            },
+        )
+
+        # Coordinates go straight from the parser into a compact column, which spills to disk if it outgrows the
+        # budget, without passing through intermediate lists
+        report = ParseReport()
+        pairs = read_coordinate_pairs(content, paths, report, deadline)
+        if params.region:
+            filter_report = FilterReport()
+            pairs = filter_points(pairs, params.region, filter_report)
+        coordinates = FloatColumn(pairs, budget, "coordinates", width=2)
+
+        await process.log("Parsed coordinate values", data=report.model_dump())
+        if params.region:
+            await process.log(
+                "Filtered points by region", data=filter_report.model_dump()
+            )
+
+        legend = None
+        if paths.color_by:
+            previous_legend = None
+            if continuing and "legend" in params.previous_map.metadata:
+                previous_legend = Legend.model_validate(
+                    params.previous_map.metadata["legend"]
+                )
+            # Only values of points that will be drawn, so the legend describes the map rather than the artifact
+            values = [
+                value if lat is not None and lon is not None else None
+                for value, (lat, lon) in zip(
+                    read_raw_path(content, paths.color_by), coordinates
+                )
+            ]
+            extra_values, legend = encode_color_values(values, previous_legend)
+        else:
+            extra_values = None
+
+        options = output_options_from_env()
+        incremental_output = params.incremental_output if continuing else None
+        previous_features = []
+        if incremental_output == "append" and params.previous_map.metadata.get(
+            "transform"
+        ) != quantization_transform(options):
+            # Appending would mix coordinates on different grids under a single transform
+            await process.log(
+                "Previous map stores coordinates differently; continuing it instead of appending to it"
+            )
+            incremental_output = "delta"
+        if incremental_output == "append":
+            try:
+                async with asyncio.timeout(deadline.remaining()):
+                    previous_geo = await retrieve_artifact_content(
+                        params.previous_map, process, budget, deadline
+                    )
+                previous_features = previous_geo["features"]
+            except TimeoutError:
+                deadline.interrupt("retrieving the previous map")
+                incremental_output = "delta"
+            except MemoryBudgetExceeded as e:
+                await process.log(
+                    f"Previous map is too large to append to; continuing it instead: {e}"
+                )
+                incremental_output = "delta"
+
+        rendered_rows = 0
+
+        def count_rows(rows):
+            nonlocal rendered_rows
+            for row in rows:
+                rendered_rows += 1
+                yield row
+
+        sizes = CoordinateSizes()
+        coords = quantize_coordinates(
+            deadline.limit(coordinates, "rendering points"), options, sizes
+        )
+        # Features are rendered lazily as they are written, so the whole collection never exists in memory
+        features = itertools.chain(
+            previous_features,
+            iter_features(count_rows(coords), extra_values, start_id=start_id),
+        )
+
+        buffer = SpillBuffer(budget, "output")
+        encode_start = time.perf_counter()
+        with encoded_writer(buffer, options.encoding) as writer:
+            points, json_size = write_feature_collection(features, writer)
+        encode_seconds = time.perf_counter() - encode_start
+        # What the JSON would have weighed with the coordinates at full precision
+        unquantized_size = json_size - sizes.quantized + sizes.original
+        del features, previous_features
+        coordinates.close()
+
+        metadata = {
+            "format": "geojson",
+            "schema_fingerprint": fingerprint,
+            "property_paths": paths.model_dump(),
+            # Only rows that made it into the map; a continuation picks up right after them
+            "next_feature_id": start_id + rendered_rows,
+        }
+        if legend:
+            metadata["legend"] = legend.model_dump(exclude_none=True)
+        if transform := quantization_transform(options):
+            metadata["transform"] = transform
+        if options.encoding != "identity":
+            metadata["content_encoding"] = options.encoding
+
+        if deadline.interrupted:
+            note = f"Ran out of time while {deadline.interrupted}; the map only includes the {points} points processed so far"
+            metadata |= {"partial": True, "note": note}
+            await process.log(note)
+
+        if budget.spilled:
+            await process.log(
+                "Memory budget exceeded; spilled intermediate data to disk",
+                data={"budget": budget.limit, "spilled": budget.spilled},
+            )
+
+        await process.log(
+            "Encoded map data",
+            data={
+                "points": points,
+                "precision": options.precision,
+                "encoding": options.encoding,
+                "unquantized_json_bytes": unquantized_size,
+                "json_bytes": json_size,
+                "encoded_bytes": buffer.size,
+                "unquantized_json_bytes_per_point": (
+                    unquantized_size / points if points else None
+                ),
+                "json_bytes_per_point": json_size / points if points else None,
+                "encoded_bytes_per_point": buffer.size / points if points else None,
+            },
+        )
+
+        try:
+            content = buffer.getvalue()
+        finally:
+            buffer.close()
+
+        return MapResult(
+            content=content,
+            metadata=metadata,
+            incremental_output=incremental_output,
+            encode_seconds=encode_seconds,
+        )
+
+
+async def continue_map(
+    previous_map: Artifact, fingerprint: str, process: IChatBioAgentProcess
+) -> tuple[Optional[PropertyPaths], int]:
+    """
+    Returns the property paths and the next feature ID recorded in a previous map artifact, provided the previous map
+    was made from data with the same schema. Otherwise, returns (None, 0) and the map is built from scratch.
+    """
+    metadata = previous_map.metadata
+    if metadata.get("schema_fingerprint") != fingerprint:
+        await process.log(
+            "Artifact schema does not match the previous map; building a new map instead"
+        )
+        return None, 0
+
+    await process.log("Reusing property paths from the previous map")
+    paths = PropertyPaths.model_validate(metadata["property_paths"])
+    return paths, metadata["next_feature_id"]
 
 
-def create_app() -> Starlette:
+def create_app(agent: MapAgent = None) -> Starlette:
     dotenv.load_dotenv()
-    agent = MapAgent()
+    agent = agent or MapAgent()
     app = build_agent_app(agent)
     return app
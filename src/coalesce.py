@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+from ichatbio.agent_response import IChatBioAgentProcess
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class SharedProcess:
+    """
+    Stands in for an IChatBioAgentProcess during a computation shared by several requests. Log messages are forwarded
+    to every subscribed process; processes that subscribe late first receive the messages they missed.
+
+    Every subscriber receives the same messages, so a shared computation must not log anything specific to one
+    caller, like conversation-local artifact IDs or paths on this host.
+    """
+
+    def __init__(self):
+        self._history: list[tuple[str, Optional[dict]]] = []
+        self._subscribers: list[IChatBioAgentProcess] = []
+
+    async def log(self, text: str, data: dict = None):
+        self._history.append((text, data))
+        for process in list(self._subscribers):
+            try:
+                await process.log(text, data=data)
+            except Exception:
+                # e.g., the caller disconnected; that shouldn't fail the computation for everyone else
+                logger.warning(
+                    "Dropping a subscriber that failed to log", exc_info=True
+                )
+                self.unsubscribe(process)
+
+    async def subscribe(self, process: IChatBioAgentProcess):
+        sent = 0
+        while sent < len(self._history):
+            text, data = self._history[sent]
+            await process.log(text, data=data)
+            sent += 1
+        self._subscribers.append(process)
+
+    def unsubscribe(self, process: IChatBioAgentProcess):
+        if process in self._subscribers:
+            self._subscribers.remove(process)
+
+
+class _Flight(Generic[T]):
+    def __init__(self, task: asyncio.Task[T], shared: SharedProcess):
+        self.task = task
+        self.shared = shared
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces concurrent computations with the same key: the first caller starts the computation, and callers that
+    arrive while it is still running wait for the same result instead of repeating the work.
+
+    Example:
+
+        flights = SingleFlight()
+        result = await flights.run(key, lambda shared: compute(shared), process)
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, _Flight[T]] = {}
+        self.computations = 0
+        """The number of computations that were started."""
+        self.hits = 0
+        """The number of callers that joined a computation already in progress."""
+
+    async def run(
+        self,
+        key: Hashable,
+        compute: Callable[[SharedProcess], Awaitable[T]],
+        process: IChatBioAgentProcess,
+    ) -> T:
+        flight = self._flights.get(key)
+
+        if flight is None:
+            self.computations += 1
+            shared = SharedProcess()
+            flight = _Flight(asyncio.create_task(compute(shared)), shared)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.hits += 1
+            await process.log(
+                "Joined an identical request that is already in progress",
+                data=self.stats(),
+            )
+
+        await flight.shared.subscribe(process)
+        try:
+            # Shielded so that one caller giving up does not cancel the work for the others
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.shared.unsubscribe(process)
+
+    def _forget(self, key: Hashable, flight: _Flight[T]):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        return {"computations": self.computations, "hits": self.hits}
@@ -0,0 +1,200 @@
+import bisect
+import math
+import statistics
+from collections import Counter
+from typing import Literal, Optional, Sequence
+
+from pydantic import BaseModel
+
+from util import JSON
+
+PALETTE = (
+    "#4e79a7",
+    "#f28e2b",
+    "#e15759",
+    "#76b7b2",
+    "#59a14f",
+    "#edc948",
+    "#b07aa1",
+    "#ff9da7",
+    "#9c755f",
+    "#bab0ac",
+)
+"""Colors assigned to codes in order. The last, neutral color is reserved for values without their own legend entry."""
+
+OTHER_COLOR = PALETTE[-1]
+
+MAX_CATEGORIES = len(PALETTE) - 1
+"""The number of distinct values that get their own legend entry; the rest share an "other" entry."""
+
+QUANTILE_PALETTE = ("#fef0d9", "#fdcc8a", "#fc8d59", "#e34a33", "#b30000")
+"""A sequential palette for numeric values, from low to high."""
+
+
+class LegendEntry(BaseModel):
+    code: int
+    color: str
+    count: int
+    """The number of points with this code in the map so far."""
+    value: Optional[str | int | float | bool] = None
+    """For categorical legends, the value that the code stands for. Unset for the "other" entry."""
+    min: Optional[float] = None
+    """For quantile legends, the smallest value in the bin."""
+    max: Optional[float] = None
+    """For quantile legends, the largest value in the bin."""
+
+
+class Legend(BaseModel):
+    """Maps the integer codes stored in each feature's "value" property back to what they stand for."""
+
+    type: Literal["categorical", "quantile"]
+    entries: list[LegendEntry]
+    edges: Optional[list[float]] = None
+    """For quantile legends, the boundaries between consecutive bins. A value equal to an edge falls in the lower bin."""
+    other_code: Optional[int] = None
+    """For categorical legends, the code shared by the values that didn't get their own entry, if there are any."""
+
+
+def _as_number(value: JSON) -> Optional[float]:
+    match value:
+        case bool():
+            return None
+        case int() | float():
+            number = float(value)
+        case str():
+            try:
+                number = float(value)
+            except ValueError:
+                return None
+        case _:
+            return None
+    return None if math.isnan(number) or math.isinf(number) else number
+
+
+def _category_key(value: JSON) -> tuple[type, JSON]:
+    # True == 1 and False == 0 hash the same, so values are told apart by type as well
+    return type(value), value
+
+
+def encode_categories(
+    values: Sequence[JSON],
+    previous: Legend = None,
+    max_categories: int = MAX_CATEGORIES,
+) -> tuple[list[Optional[int]], Legend]:
+    """
+    Replaces each value with an integer code. Codes are assigned in order of decreasing frequency, after any codes
+    already assigned by a previous legend. Only the first `max_categories` distinct values get codes of their own;
+    any others share an "other" code, so that high-cardinality columns (e.g., record IDs) don't bloat the legend.
+    """
+    entries = list(previous.entries) if previous else []
+    other_code = previous.other_code if previous else None
+    codes_by_key = {
+        _category_key(entry.value): entry.code
+        for entry in entries
+        if entry.code != other_code
+    }
+
+    counts = Counter(_category_key(value) for value in values if value is not None)
+    for key, _ in counts.most_common():
+        if key in codes_by_key:
+            continue
+        if len(codes_by_key) < max_categories:
+            code = len(entries)
+            codes_by_key[key] = code
+            entries.append(
+                LegendEntry(
+                    code=code,
+                    color=PALETTE[code % (len(PALETTE) - 1)],
+                    count=0,
+                    value=key[1],
+                )
+            )
+        else:
+            if other_code is None:
+                other_code = len(entries)
+                entries.append(LegendEntry(code=other_code, color=OTHER_COLOR, count=0))
+            codes_by_key[key] = other_code
+
+    for key, count in counts.items():
+        entry = entries[codes_by_key[key]]
+        entries[entry.code] = entry.model_copy(update={"count": entry.count + count})
+
+    codes = [
+        None if value is None else codes_by_key[_category_key(value)]
+        for value in values
+    ]
+    return codes, Legend(type="categorical", entries=entries, other_code=other_code)
+
+
+def bin_quantiles(
+    values: Sequence[Optional[float]],
+    bins: int = len(QUANTILE_PALETTE),
+    previous: Legend = None,
+) -> tuple[list[Optional[int]], Legend]:
+    """
+    Replaces each number with the index of its quantile bin. The bin edges are computed from one sorted copy of the
+    values, or taken from a previous legend so that codes stay comparable across maps.
+    """
+    if previous:
+        edges = previous.edges
+        lows = [entry.min for entry in previous.entries]
+        highs = [entry.max for entry in previous.entries]
+        counts = [entry.count for entry in previous.entries]
+    else:
+        present = sorted(value for value in values if value is not None)
+        bins = max(1, min(bins, len(set(present))))
+        if bins > 1:
+            quantiles = statistics.quantiles(present, n=bins, method="inclusive")
+            edges = sorted(set(quantiles))
+        else:
+            edges = []
+        size = len(edges) + 1
+        lows, highs, counts = [None] * size, [None] * size, [0] * size
+
+    codes = [
+        None if value is None else bisect.bisect_left(edges, value) for value in values
+    ]
+
+    for value, code in zip(values, codes):
+        if code is not None:
+            counts[code] += 1
+            lows[code] = value if lows[code] is None else min(lows[code], value)
+            highs[code] = value if highs[code] is None else max(highs[code], value)
+
+    colors = _sequential_colors(len(counts))
+    entries = [
+        LegendEntry(code=code, color=color, count=count, min=low, max=high)
+        for code, (color, count, low, high) in enumerate(
+            zip(colors, counts, lows, highs)
+        )
+    ]
+    return codes, Legend(type="quantile", entries=entries, edges=edges)
+
+
+def _sequential_colors(n: int) -> list[str]:
+    if n <= 1:
+        return list(QUANTILE_PALETTE[-1:])
+    last = len(QUANTILE_PALETTE) - 1
+    return [QUANTILE_PALETTE[round(i * last / (n - 1))] for i in range(n)]
+
+
+def encode_color_values(
+    values: Sequence[JSON], previous: Legend = None
+) -> tuple[list[Optional[int]], Legend]:
+    """
+    Encodes the color_by column as integer codes plus a legend. Columns where every value is a number (or a numeric
+    string) are binned into quantiles; anything else is treated as categorical.
+    """
+    numbers = [_as_number(value) for value in values]
+    is_numeric = all(
+        number is not None
+        for number, value in zip(numbers, values)
+        if value is not None
+    ) and any(number is not None for number in numbers)
+
+    if previous:
+        is_numeric = previous.type == "quantile"
+
+    if is_numeric:
+        return bin_quantiles(numbers, previous=previous)
+    return encode_categories(values, previous=previous)
@@ -0,0 +1,187 @@
+import re
+from typing import Iterable, Literal, Optional
+
+from pydantic import BaseModel
+
+from util import JSON
+
+Axis = Literal["latitude", "longitude"]
+
+AXIS_LIMITS = {"latitude": 90.0, "longitude": 180.0}
+AXIS_HEMISPHERES = {"latitude": ("N", "S"), "longitude": ("E", "W")}
+
+# Precompiled once; these are matched against every string value that is not already a plain decimal number.
+DMS_PATTERN = re.compile(
+    r"""
+    ^\s*
+    (?P<prefix>[NSEW])?\s*
+    (?P<sign>[-+])?\s*
+    (?P<degrees>\d+(?:[.,]\d+)?)\s*(?:°|º|˚|:)?\s*
+    (?:(?P<minutes>\d+(?:[.,]\d+)?)\s*(?:'|′|’|:)?\s*)?
+    (?:(?P<seconds>\d+(?:[.,]\d+)?)\s*(?:"|″|''|”)?\s*)?
+    (?P<suffix>[NSEW])?
+    \s*$
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+
+PAIR_SEPARATOR_PATTERN = re.compile(r"\s*[;,]\s*")
+HEMISPHERE_PAIR_PATTERN = re.compile(
+    r"^\s*(?P<latitude>.*?[NS])\s*[;,]?\s*(?P<longitude>.*[EW])\s*$", re.IGNORECASE
+)
+
+
+class ParseReport(BaseModel):
+    """Counts of what happened to the values in a coordinate column."""
+
+    parsed: int = 0
+    """Values that were converted to a coordinate, including repaired values."""
+
+    repaired: int = 0
+    """Values that were not plain decimal numbers but could still be interpreted, e.g. "40°05'N"."""
+
+    rejected: int = 0
+    """Non-empty values that could not be interpreted or fell outside the valid range."""
+
+    missing: int = 0
+    """Empty values (null or blank strings)."""
+
+    def __add__(self, other: "ParseReport") -> "ParseReport":
+        return ParseReport(
+            parsed=self.parsed + other.parsed,
+            repaired=self.repaired + other.repaired,
+            rejected=self.rejected + other.rejected,
+            missing=self.missing + other.missing,
+        )
+
+
+def _to_float(number: Optional[str]) -> float:
+    return float(number.replace(",", ".")) if number else 0.0
+
+
+def parse_dms(value: str, axis: Axis) -> Optional[float]:
+    """
+    Interprets a degrees-minutes-seconds or hemisphere-qualified string, e.g. "40°05'N", "-99.225 W", "S 12 30 15".
+    Returns None if the string can't be interpreted as a coordinate on the given axis.
+    """
+    match = DMS_PATTERN.match(value)
+    if match is None:
+        return None
+
+    prefix, suffix = match["prefix"], match["suffix"]
+    if prefix and suffix:
+        return None
+    hemisphere = (prefix or suffix or "").upper()
+    positive, negative = AXIS_HEMISPHERES[axis]
+    if hemisphere and hemisphere not in (positive, negative):
+        return None
+
+    minutes = _to_float(match["minutes"])
+    seconds = _to_float(match["seconds"])
+    if minutes >= 60 or seconds >= 60:
+        return None
+
+    coordinate = _to_float(match["degrees"]) + minutes / 60 + seconds / 3600
+    if match["sign"] == "-" or hemisphere == negative:
+        coordinate = -coordinate
+    return coordinate
+
+
+def parse_coordinate(value: JSON, axis: Axis, report: ParseReport) -> Optional[float]:
+    """
+    Converts one raw coordinate value to a float and counts the outcome in the report. Plain numbers and decimal
+    strings take a fast path through float(); anything else is matched against precompiled DMS/hemisphere patterns.
+    Values that can't be interpreted, or that fall outside the valid range for the axis, become None.
+    """
+    coordinate = None
+    repaired = False
+
+    match value:
+        case None:
+            report.missing += 1
+            return None
+        case bool():
+            pass
+        case int() | float():
+            coordinate = float(value)
+        case str() as text:
+            if not text.strip():
+                report.missing += 1
+                return None
+            try:
+                coordinate = float(text)
+            except ValueError:
+                coordinate = parse_dms(text, axis)
+                repaired = coordinate is not None
+
+    # float() accepts "nan" and "inf", which also fail the range check
+    limit = AXIS_LIMITS[axis]
+    if coordinate is None or not -limit <= coordinate <= limit:
+        report.rejected += 1
+        return None
+
+    report.parsed += 1
+    report.repaired += repaired
+    return coordinate
+
+
+def parse_coordinates(
+    values: Iterable[JSON], axis: Axis
+) -> tuple[list[Optional[float]], ParseReport]:
+    """Converts a whole column of raw coordinate values to floats. See parse_coordinate()."""
+    report = ParseReport()
+    coordinates = [parse_coordinate(value, axis, report) for value in values]
+    return coordinates, report
+
+
+def split_coordinate_pair(value: JSON) -> tuple[JSON, JSON]:
+    """
+    Splits a combined coordinate string such as "23.07, -99.22", "23.07 -99.22" or "40°05'N 99°13'W" into its
+    latitude and longitude parts. Parts that can't be separated are returned as None.
+    """
+    match value:
+        case str() as text:
+            match HEMISPHERE_PAIR_PATTERN.match(text):
+                case re.Match() as match:
+                    return match["latitude"], match["longitude"]
+
+            parts = PAIR_SEPARATOR_PATTERN.split(text.strip())
+            if len(parts) == 2:
+                return parts[0], parts[1]
+
+            parts = text.split()
+            if len(parts) == 2:
+                return parts[0], parts[1]
+
+    return None, None
+
+
+def parse_coordinate_pair(
+    value: JSON, report: ParseReport
+) -> tuple[Optional[float], Optional[float]]:
+    """Splits and parses one combined "lat,lon" value. The report counts the latitude and longitude separately."""
+    latitude, longitude = split_coordinate_pair(value)
+    if latitude is None and longitude is None and value not in (None, ""):
+        # The value wasn't empty, but it couldn't be split either
+        report.rejected += 2
+        return None, None
+    return (
+        parse_coordinate(latitude, "latitude", report),
+        parse_coordinate(longitude, "longitude", report),
+    )
+
+
+def parse_coordinate_pairs(
+    values: Iterable[JSON],
+) -> tuple[list[Optional[float]], list[Optional[float]], ParseReport]:
+    """
+    Splits a column of combined "lat,lon" values into separate latitude and longitude columns and parses both.
+    The returned report covers both columns.
+    """
+    report = ParseReport()
+    latitudes, longitudes = [], []
+    for value in values:
+        latitude, longitude = parse_coordinate_pair(value, report)
+        latitudes.append(latitude)
+        longitudes.append(longitude)
+    return latitudes, longitudes, report
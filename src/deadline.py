@@ -0,0 +1,56 @@
+import os
+import time
+from typing import Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_TIME_BUDGET = 120.0
+
+
+def time_budget_from_env() -> Optional[float]:
+    """
+    Reads the per-request time budget, in seconds, from the MAP_AGENT_TIME_BUDGET_SECONDS environment variable. "none"
+    disables the budget.
+    """
+    seconds = os.getenv("MAP_AGENT_TIME_BUDGET_SECONDS")
+    if seconds is None:
+        return DEFAULT_TIME_BUDGET
+    if seconds.lower() == "none":
+        return None
+    return float(seconds)
+
+
+class Deadline:
+    """
+    The point in time by which a request should be answered. Long-running stages check it cooperatively and stop
+    early, so the agent can respond with whatever it has so far.
+    """
+
+    def __init__(self, seconds: Optional[float]):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        self.interrupted: Optional[str] = None
+        """The first stage that was cut short by the deadline, if any."""
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None if there is no deadline."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def interrupt(self, stage: str):
+        if self.interrupted is None:
+            self.interrupted = stage
+
+    def limit(self, items: Iterable[T], stage: str, every: int = 1024) -> Iterator[T]:
+        """
+        Yields items until the deadline passes, checking the clock every `every` items. If the deadline cuts the
+        iteration short, `stage` is recorded as interrupted.
+        """
+        for i, item in enumerate(items):
+            if i % every == 0 and self.expired():
+                self.interrupt(stage)
+                return
+            yield item
@@ -0,0 +1,275 @@
+import io
+import json
+import math
+import mmap
+import os
+import tempfile
+from array import array
+from collections.abc import Sequence
+from typing import Iterable, Optional, IO
+
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+
+
+def memory_budget_from_env() -> int:
+    """Reads the per-request memory budget, in megabytes, from the MAP_AGENT_MEMORY_BUDGET_MB environment variable."""
+    megabytes = os.getenv("MAP_AGENT_MEMORY_BUDGET_MB")
+    if megabytes is None:
+        return DEFAULT_MEMORY_BUDGET
+    return int(float(megabytes) * 1024 * 1024)
+
+
+class MemoryBudgetExceeded(ValueError):
+    pass
+
+
+class MemoryBudget:
+    """
+    Keeps a running account of the large allocations made while handling a single request. Once the account exceeds
+    the budget, intermediate data should be spilled to disk instead of being kept on the heap. Data that can't be
+    spilled, like the artifact itself, is checked against the budget before it is loaded.
+
+    The accounting is approximate: only allocations that scale with the size of the artifact are charged.
+    """
+
+    def __init__(self, limit: int = None):
+        self.limit = memory_budget_from_env() if limit is None else limit
+        self.used = 0
+        self.spilled: list[str] = []
+
+    def charge(self, nbytes: int):
+        self.used += nbytes
+
+    def release(self, nbytes: int):
+        self.used = max(0, self.used - nbytes)
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.limit - self.used)
+
+    def fits(self, nbytes: int) -> bool:
+        return self.used + nbytes <= self.limit
+
+    def check(self, nbytes: int, what: str):
+        """Raises MemoryBudgetExceeded if `nbytes` more would not fit in the budget."""
+        if not self.fits(nbytes):
+            raise MemoryBudgetExceeded(
+                f"{what} ({nbytes} bytes) does not fit in the memory budget ({self.remaining} of {self.limit} bytes left)"
+            )
+
+
+class FloatColumn(Sequence):
+    """
+    A compact column of optional floats, or of fixed-width tuples of optional floats. Missing values are stored as
+    NaN. The column is built incrementally from an iterator and kept in memory while it fits in the budget; if it
+    outgrows the budget, what was built so far moves to a temporary file, the rest is appended there, and the file
+    is memory-mapped once the column is complete.
+    """
+
+    CHUNK_SIZE = 8192
+    """The number of floats collected before they are added to the column."""
+
+    def __init__(
+        self,
+        values: Iterable[Optional[float] | tuple[Optional[float], ...]],
+        budget: MemoryBudget,
+        name: str,
+        width: int = 1,
+    ):
+        self.width = width
+        self._budget = budget
+        self._name = name
+        self._charged = 0
+        self._file: Optional[IO[bytes]] = None
+        self._mmap: Optional[mmap.mmap] = None
+
+        data, chunk = array("d"), array("d")
+        for value in values:
+            if width == 1:
+                chunk.append(math.nan if value is None else value)
+            else:
+                chunk.extend(math.nan if v is None else v for v in value)
+            if len(chunk) >= self.CHUNK_SIZE:
+                data = self._store(data, chunk)
+                chunk = array("d")
+        data = self._store(data, chunk)
+
+        if self._file is None:
+            self._view = memoryview(data)
+        else:
+            self._file.flush()
+            nbytes = self._file.tell()
+            self._mmap = mmap.mmap(self._file.fileno(), nbytes, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap).cast("d")
+
+    def _store(self, data: array, chunk: array) -> array:
+        if self._file is not None:
+            chunk.tofile(self._file)
+            return data
+
+        nbytes = len(chunk) * chunk.itemsize
+        if self._budget.fits(nbytes) or nbytes == 0:
+            self._budget.charge(nbytes)
+            self._charged += nbytes
+            data.extend(chunk)
+            return data
+
+        self._file = tempfile.TemporaryFile(prefix="map-agent-")
+        data.tofile(self._file)
+        chunk.tofile(self._file)
+        self._budget.release(self._charged)
+        self._charged = 0
+        self._budget.spilled.append(self._name)
+        return array("d")
+
+    @property
+    def spilled(self) -> bool:
+        return self._mmap is not None
+
+    def __len__(self) -> int:
+        return len(self._view) // self.width
+
+    def _item(self, index: int):
+        if self.width == 1:
+            value = self._view[index]
+            return None if math.isnan(value) else value
+        start = index * self.width
+        return tuple(
+            None if math.isnan(value) else value
+            for value in self._view[start : start + self.width]
+        )
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._item(index)
+
+    def __iter__(self):
+        if self.width == 1:
+            for value in self._view:
+                yield None if math.isnan(value) else value
+        else:
+            for i in range(len(self)):
+                yield self._item(i)
+
+    def close(self):
+        self._view.release()
+        self._budget.release(self._charged)
+        self._charged = 0
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+
+
+class SpillBuffer:
+    """
+    A binary output buffer that stays in memory while it fits in what is left of the budget and moves to a temporary
+    file beyond that.
+    """
+
+    def __init__(self, budget: MemoryBudget, name: str):
+        self._budget = budget
+        self._name = name
+        self._memory: Optional[io.BytesIO] = io.BytesIO()
+        self._file: Optional[IO[bytes]] = None
+        self.size = 0
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def write(self, chunk: bytes):
+        if self.spilled:
+            self._file.write(chunk)
+        elif self._budget.fits(len(chunk)):
+            self._budget.charge(len(chunk))
+            self._memory.write(chunk)
+        else:
+            self._file = tempfile.TemporaryFile(prefix="map-agent-")
+            self._file.write(self._memory.getbuffer())
+            self._file.write(chunk)
+            self._memory = None
+            self._budget.release(self.size)
+            self._budget.spilled.append(self._name)
+        self.size += len(chunk)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def getvalue(self) -> bytes:
+        """
+        Reads the whole buffer back, through a memory map if it was spilled to disk. This makes one copy on the heap,
+        which can't be avoided as long as artifacts are uploaded as a single bytes object.
+        """
+        if not self.spilled:
+            return self._memory.getvalue()
+
+        self._file.flush()
+        with mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ) as m:
+            return m[:]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._memory = None
+
+
+def _write_pieces(
+    pieces: Iterable[str], buffer: SpillBuffer | IO[bytes], chunk_size: int
+) -> int:
+    written = 0
+    pending, pending_size = [], 0
+    for piece in pieces:
+        pending.append(piece)
+        pending_size += len(piece)
+        if pending_size >= chunk_size:
+            chunk = "".join(pending).encode("utf-8")
+            buffer.write(chunk)
+            written += len(chunk)
+            pending, pending_size = [], 0
+    if pending:
+        chunk = "".join(pending).encode("utf-8")
+        buffer.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def write_json(
+    content, buffer: SpillBuffer | IO[bytes], chunk_size: int = 64 * 1024
+) -> int:
+    """
+    Serializes content into the buffer piece by piece, without building the whole JSON string first. Returns the
+    number of bytes written.
+    """
+    return _write_pieces(json.JSONEncoder().iterencode(content), buffer, chunk_size)
+
+
+def write_feature_collection(
+    features: Iterable[dict],
+    buffer: SpillBuffer | IO[bytes],
+    chunk_size: int = 64 * 1024,
+) -> tuple[int, int]:
+    """
+    Serializes a GeoJSON FeatureCollection one feature at a time, so that the features can be produced lazily and
+    the collection is never held in memory as a whole. Returns the number of features and of bytes written.
+    """
+    encoder = json.JSONEncoder()
+    count = 0
+
+    def pieces():
+        nonlocal count
+        yield '{"type": "FeatureCollection", "features": ['
+        for feature in features:
+            if count:
+                yield ", "
+            yield from encoder.iterencode(feature)
+            count += 1
+        yield "]}"
+
+    written = _write_pieces(pieces(), buffer, chunk_size)
+    return count, written
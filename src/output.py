@@ -0,0 +1,158 @@
+import gzip
+import os
+from contextlib import contextmanager
+from typing import BinaryIO, Iterable, Iterator, Literal, Optional
+
+from pydantic import BaseModel
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from memory import SpillBuffer
+
+Encoding = Literal["identity", "gzip", "zstd"]
+
+
+class OutputOptions(BaseModel):
+    precision: Optional[int] = 6
+    """Number of decimal places kept in coordinates. None keeps full float precision."""
+
+    integer_quantization: bool = False
+    """Store coordinates as integers on a grid of 10^-precision degrees; the transform is stored in the metadata."""
+
+    encoding: Encoding = "identity"
+    """Compression applied to the artifact body."""
+
+
+def output_options_from_env() -> OutputOptions:
+    """
+    Reads output size controls from the environment:
+
+    - MAP_AGENT_COORDINATE_PRECISION: decimal places to keep, or "full"
+    - MAP_AGENT_INTEGER_COORDINATES: "1" to store coordinates as quantized integers
+    - MAP_AGENT_CONTENT_ENCODING: "identity", "gzip" or "zstd"
+    """
+    precision = os.getenv("MAP_AGENT_COORDINATE_PRECISION", "6")
+    options = OutputOptions(
+        precision=None if precision == "full" else int(precision),
+        integer_quantization=os.getenv("MAP_AGENT_INTEGER_COORDINATES") == "1",
+        encoding=os.getenv("MAP_AGENT_CONTENT_ENCODING", "identity"),
+    )
+
+    if options.integer_quantization and options.precision is None:
+        raise ValueError("Integer coordinates require a coordinate precision")
+    if options.encoding == "zstd" and zstandard is None:
+        raise ValueError('The "zstandard" package is required for zstd encoding')
+
+    return options
+
+
+def quantization_transform(options: OutputOptions) -> Optional[dict]:
+    """
+    Describes how to decode integer coordinates, in the style of TopoJSON: position = quantized * scale + translate,
+    with positions in (longitude, latitude) order.
+    """
+    if not options.integer_quantization:
+        return None
+    scale = 10**-options.precision
+    return {"scale": [scale, scale], "translate": [-180, -90]}
+
+
+class CoordinateSizes(BaseModel):
+    """The number of characters that the coordinates take up in the JSON output, before and after quantization."""
+
+    original: int = 0
+    quantized: int = 0
+
+
+def quantize_coordinates(
+    coordinates: Iterable[tuple[Optional[float], Optional[float]]],
+    options: OutputOptions,
+    sizes: CoordinateSizes = None,
+) -> Iterator[tuple[Optional[float | int], Optional[float | int]]]:
+    """
+    Rounds (lat, lon) pairs to the configured precision, or converts them to integers on the quantization grid. If
+    `sizes` is given, it tallies how long the coordinates are when written out, before and after.
+    """
+    precision = options.precision
+    if precision is None:
+        quantize = None
+    elif options.integer_quantization:
+        factor = 10**precision
+
+        def quantize(lat: float, lon: float) -> tuple[int, int]:
+            return round((lat + 90) * factor), round((lon + 180) * factor)
+
+    else:
+
+        def quantize(lat: float, lon: float) -> tuple[float, float]:
+            return round(lat, precision), round(lon, precision)
+
+    for lat, lon in coordinates:
+        if lat is None or lon is None:
+            yield lat, lon
+            continue
+
+        qlat, qlon = (lat, lon) if quantize is None else quantize(lat, lon)
+        if sizes is not None:
+            # The json module writes numbers with repr()
+            sizes.original += len(repr(lat)) + len(repr(lon))
+            sizes.quantized += len(repr(qlat)) + len(repr(qlon))
+        yield qlat, qlon
+
+
+@contextmanager
+def encoded_writer(buffer: SpillBuffer, encoding: Encoding):
+    """Wraps the buffer in a compressor for the given content encoding. The buffer itself is left open."""
+    match encoding:
+        case "identity":
+            yield buffer
+        case "gzip":
+            with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as writer:
+                yield writer
+        case "zstd":
+            compressor = zstandard.ZstdCompressor()
+            with compressor.stream_writer(buffer, closefd=False) as writer:
+                yield writer
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def decode_body(body: bytes, encoding: Encoding) -> bytes:
+    """
+    Reverses the content encoding of an artifact body. Bodies that were already decoded in transit (e.g., by an HTTP
+    client honoring a Content-Encoding header) are returned as they are.
+    """
+    match encoding:
+        case "gzip" if body.startswith(GZIP_MAGIC):
+            return gzip.decompress(body)
+        case "zstd" if body.startswith(ZSTD_MAGIC):
+            if zstandard is None:
+                raise ValueError(
+                    'The "zstandard" package is required for zstd encoding'
+                )
+            return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    return body
+
+
+def decoded_reader(file: BinaryIO, encoding: Encoding) -> Optional[BinaryIO]:
+    """
+    Like decode_body(), but decompresses a file-like body (e.g., a memory-mapped file) as it is read, rather than all at
+    once. Returns None if the body is not actually encoded.
+    """
+    head = file.read(4)
+    file.seek(0)
+    match encoding:
+        case "gzip" if head.startswith(GZIP_MAGIC):
+            return gzip.GzipFile(fileobj=file, mode="rb")
+        case "zstd" if head.startswith(ZSTD_MAGIC):
+            if zstandard is None:
+                raise ValueError(
+                    'The "zstandard" package is required for zstd encoding'
+                )
+            return zstandard.ZstdDecompressor().stream_reader(file, closefd=False)
+    return None
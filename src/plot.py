@@ -1,11 +1,14 @@
-from typing import Optional, Self, Iterator
+import asyncio
+import itertools
+from typing import Iterable, Optional, Self, Iterator
 
-import geojson
 from instructor import from_openai, retry, AsyncInstructor
 from openai import AsyncOpenAI
 from pydantic import BaseModel
 from pydantic import Field, model_validator
 
+from coordinates import ParseReport, parse_coordinate, parse_coordinate_pair
+from deadline import Deadline
 from util import JSON
 
 Path = list[str]
@@ -16,7 +19,9 @@ class GiveUp(BaseModel):
 
 
 class PropertyPaths(BaseModel):
-    latitude: Path
+    latitude: Path = Field(
+        description='If latitude and longitude are stored together in one property (e.g. "23.07, -99.22"), use the same path for both.'
+    )
     longitude: Path
     color_by: Optional[Path] = Field(
         None,
@@ -83,7 +88,7 @@ latitude: ["records", "data", "geo", "latitude"]
 """
 
 
-async def select_properties(request: str, schema: dict):
+async def select_properties(request: str, schema: dict, deadline: Deadline = None):
     model = make_validated_response_model(schema)
 
     messages = [
@@ -97,51 +102,125 @@ async def select_properties(request: str, schema: dict):
 
     client: AsyncInstructor = from_openai(AsyncOpenAI())
     try:
-        generation = await client.chat.completions.create(
-            model="gpt-4.1-unfiltered",
-            temperature=0,
-            response_model=model,
-            messages=messages,
-            max_retries=5,
-        )
+        async with asyncio.timeout(deadline.remaining() if deadline else None):
+            generation = await client.chat.completions.create(
+                model="gpt-4.1-unfiltered",
+                temperature=0,
+                response_model=model,
+                messages=messages,
+                max_retries=5,
+            )
     except retry.InstructorRetryException as e:
         raise
+    except TimeoutError:
+        deadline.interrupt("selecting property paths")
+        return GiveUp(reason="Ran out of time while choosing property paths")
 
     return generation.response
 
 
-def read_path(content: JSON, path: list[str]) -> Iterator[float]:
+def read_raw_path(content: JSON, path: list[str]) -> Iterator[JSON]:
+    """Yields the values at the end of the path without converting them, so that whole columns can be parsed at once."""
     match content:
         case list() as records:
             for record in records:
-                yield from read_path(record, path)
+                yield from read_raw_path(record, path)
         case dict() as record:
             next_property = record.get(path[0])
-            yield from read_path(next_property, path[1:])
+            yield from read_raw_path(next_property, path[1:])
         case _ as scalar if len(path) == 0:
-            if scalar is None:
+            yield scalar
+
+
+def read_path(content: JSON, path: list[str]) -> Iterator[float]:
+    for scalar in read_raw_path(content, path):
+        if scalar is None:
+            yield None
+        else:
+            try:
+                yield float(scalar)
+            except ValueError:
                 yield None
-            else:
-                try:
-                    yield float(scalar)
-                except ValueError:
-                    yield None
 
 
-def render_points_as_geojson(
-    coordinates: list[(float, float)], values: list[float | int | str] = None
-) -> geojson.FeatureCollection:
+def read_coordinate_pairs(
+    content: JSON,
+    paths: PropertyPaths,
+    report: ParseReport,
+    deadline: Deadline = None,
+) -> Iterator[tuple[Optional[float], Optional[float]]]:
+    """
+    Yields parsed (latitude, longitude) pairs, counting the outcomes in the report. If both paths are the same, the
+    property is assumed to hold combined "lat,lon" values, which are split.
+
+    The raw latitude and longitude values are read together, one record at a time, so that if the deadline passes,
+    every pair read so far is still complete.
+    """
+    if paths.latitude == paths.longitude:
+        values = read_raw_path(content, paths.latitude)
+    else:
+        values = zip(
+            read_raw_path(content, paths.latitude),
+            read_raw_path(content, paths.longitude),
+        )
+    if deadline:
+        values = deadline.limit(values, "reading coordinates")
+
+    if paths.latitude == paths.longitude:
+        for value in values:
+            yield parse_coordinate_pair(value, report)
+    else:
+        for latitude, longitude in values:
+            yield (
+                parse_coordinate(latitude, "latitude", report),
+                parse_coordinate(longitude, "longitude", report),
+            )
+
+
+def read_coordinates(
+    content: JSON, paths: PropertyPaths, deadline: Deadline = None
+) -> tuple[list[Optional[float]], list[Optional[float]], ParseReport]:
+    """Reads and parses the latitude and longitude columns. See read_coordinate_pairs()."""
+    report = ParseReport()
+    latitudes, longitudes = [], []
+    for latitude, longitude in read_coordinate_pairs(content, paths, report, deadline):
+        latitudes.append(latitude)
+        longitudes.append(longitude)
+    return latitudes, longitudes, report
+
+
+def iter_features(
+    coordinates: Iterable[tuple[Optional[float], Optional[float]]],
+    values: Iterable[float | int | str] = None,
+    start_id: int = 0,
+) -> Iterator[dict]:
+    """
+    Yields a point feature for each (lat, lon) pair that has both coordinates. Features are numbered by their
+    position in the coordinate sequence, offset by `start_id`, so that maps built from consecutive pages of data have
+    distinct, stable feature IDs.
+    """
     if values is None:
-        values = (1.0 for _ in coordinates)
+        values = itertools.repeat(1.0)
 
-    geo = geojson.FeatureCollection(
-        [
-            geojson.Feature(
-                id=i, geometry=geojson.Point((lon, lat)), properties={"value": value}
-            )
-            for i, ((lat, lon), value) in enumerate(zip(coordinates, values))
-            if lat is not None and lon is not None
-        ]
-    )
+    for i, ((lat, lon), value) in enumerate(zip(coordinates, values), start=start_id):
+        if lat is not None and lon is not None:
+            # Plain dicts rather than geojson objects, which would round the coordinates to their own default
+            # precision of six decimal places; quantize_coordinates() has already applied the configured one
+            yield {
+                "type": "Feature",
+                "id": i,
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {"value": value},
+            }
 
-    return geo
+
+def render_points_as_geojson(
+    coordinates: list[(float, float)],
+    values: list[float | int | str] = None,
+    start_id: int = 0,
+) -> dict:
+    """Renders the points as a whole GeoJSON FeatureCollection. See iter_features()."""
+    return {
+        "type": "FeatureCollection",
+        "features": list(iter_features(coordinates, values, start_id)),
+    }
@@ -0,0 +1,177 @@
+from enum import IntEnum
+from typing import Iterable, Iterator, Optional
+
+from pydantic import BaseModel, Field, model_validator
+
+Ring = list[tuple[float, float]]
+
+
+class BoundingBox(BaseModel):
+    """A longitude/latitude rectangle. If west > east, the box crosses the antimeridian."""
+
+    west: float = Field(ge=-180, le=180)
+    south: float = Field(ge=-90, le=90)
+    east: float = Field(ge=-180, le=180)
+    north: float = Field(ge=-90, le=90)
+
+    @model_validator(mode="after")
+    def validate(self):
+        if self.south > self.north:
+            raise ValueError("south must not be greater than north")
+        return self
+
+
+class Polygon(BaseModel):
+    """A polygon in GeoJSON order: the first ring is the outer boundary, any others are holes. Positions are
+    (longitude, latitude) pairs."""
+
+    coordinates: list[Ring] = Field(min_length=1)
+
+    @model_validator(mode="after")
+    def validate(self):
+        for ring in self.coordinates:
+            if len(ring) < 3:
+                raise ValueError("Polygon rings need at least three positions")
+        return self
+
+
+Region = BoundingBox | Polygon
+
+
+class FilterReport(BaseModel):
+    inside: int = 0
+    outside: int = 0
+    missing: int = 0
+    """Points without coordinates, which are neither inside nor outside."""
+    grid_decided: int = 0
+    """Points accepted or rejected by the bounding box or grid index alone."""
+    exact_tests: int = 0
+    """Points that needed a full point-in-polygon test."""
+
+
+def in_bbox(lat: float, lon: float, bbox: BoundingBox) -> bool:
+    if not bbox.south <= lat <= bbox.north:
+        return False
+    if bbox.west <= bbox.east:
+        return bbox.west <= lon <= bbox.east
+    return lon >= bbox.west or lon <= bbox.east
+
+
+def in_ring(lon: float, lat: float, ring: Ring) -> bool:
+    """Even-odd ray casting test."""
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y1 > lat) != (y2 > lat) and lon < (x2 - x1) * (lat - y1) / (y2 - y1) + x1:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def in_polygon(lon: float, lat: float, polygon: Polygon) -> bool:
+    outer, *holes = polygon.coordinates
+    return in_ring(lon, lat, outer) and not any(in_ring(lon, lat, h) for h in holes)
+
+
+class Cell(IntEnum):
+    OUTSIDE = 0
+    INSIDE = 1
+    BOUNDARY = 2
+
+
+class GridIndex:
+    """
+    Divides a polygon's bounding box into a grid of cells. Cells that no polygon edge passes through lie entirely
+    inside or entirely outside the polygon, so points in them are decided by a lookup. Only points in boundary cells
+    need the full point-in-polygon test.
+    """
+
+    def __init__(self, polygon: Polygon, size: int = 32):
+        self.polygon = polygon
+        positions = [p for ring in polygon.coordinates for p in ring]
+        self.min_lon = min(lon for lon, _ in positions)
+        self.max_lon = max(lon for lon, _ in positions)
+        self.min_lat = min(lat for _, lat in positions)
+        self.max_lat = max(lat for _, lat in positions)
+        self.size = size
+        self.cell_width = (self.max_lon - self.min_lon) / size or 1.0
+        self.cell_height = (self.max_lat - self.min_lat) / size or 1.0
+
+        cells = [[None] * size for _ in range(size)]
+
+        # Conservatively mark every cell that overlaps an edge's bounding box
+        for ring in polygon.coordinates:
+            x1, y1 = ring[-1]
+            for x2, y2 in ring:
+                col_range = self._columns(min(x1, x2), max(x1, x2))
+                row_range = self._rows(min(y1, y2), max(y1, y2))
+                for row in row_range:
+                    for col in col_range:
+                        cells[row][col] = Cell.BOUNDARY
+                x1, y1 = x2, y2
+
+        for row in range(size):
+            for col in range(size):
+                if cells[row][col] is None:
+                    center_lon = self.min_lon + (col + 0.5) * self.cell_width
+                    center_lat = self.min_lat + (row + 0.5) * self.cell_height
+                    inside = in_polygon(center_lon, center_lat, polygon)
+                    cells[row][col] = Cell.INSIDE if inside else Cell.OUTSIDE
+
+        self.cells = cells
+
+    def _column(self, lon: float) -> int:
+        return min(self.size - 1, max(0, int((lon - self.min_lon) / self.cell_width)))
+
+    def _row(self, lat: float) -> int:
+        return min(self.size - 1, max(0, int((lat - self.min_lat) / self.cell_height)))
+
+    def _columns(self, low: float, high: float) -> range:
+        return range(self._column(low), self._column(high) + 1)
+
+    def _rows(self, low: float, high: float) -> range:
+        return range(self._row(low), self._row(high) + 1)
+
+    def lookup(self, lat: float, lon: float) -> Cell:
+        if not (
+            self.min_lon <= lon <= self.max_lon and self.min_lat <= lat <= self.max_lat
+        ):
+            return Cell.OUTSIDE
+        return self.cells[self._row(lat)][self._column(lon)]
+
+
+def filter_points(
+    coordinates: Iterable[tuple[Optional[float], Optional[float]]],
+    region: Region,
+    report: FilterReport,
+) -> Iterator[tuple[Optional[float], Optional[float]]]:
+    """
+    Clears the coordinates of (lat, lon) pairs outside the region, so that they are skipped when rendering, and
+    counts the outcomes in the report. Points keep their positions in the sequence, which keeps feature IDs stable.
+    """
+    index = GridIndex(region) if isinstance(region, Polygon) else None
+
+    for lat, lon in coordinates:
+        if lat is None or lon is None:
+            report.missing += 1
+            yield None, None
+            continue
+
+        if index is None:
+            inside = in_bbox(lat, lon, region)
+            report.grid_decided += 1
+        else:
+            match index.lookup(lat, lon):
+                case Cell.BOUNDARY:
+                    inside = in_polygon(lon, lat, region)
+                    report.exact_tests += 1
+                case cell:
+                    inside = cell == Cell.INSIDE
+                    report.grid_decided += 1
+
+        if inside:
+            report.inside += 1
+            yield lat, lon
+        else:
+            report.outside += 1
+            yield None, None
@@ -1,9 +1,30 @@
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import BinaryIO, Optional
+
 import httpx
 from genson import SchemaBuilder
 from genson.schema.strategies import Object
 from ichatbio.agent_response import IChatBioAgentProcess
 from ichatbio.types import Artifact
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from deadline import Deadline
+from memory import MemoryBudget
+from output import decode_body, decoded_reader
+
+READ_CHUNK_SIZE = 1 << 20
+
 JSON = dict | list | str | int | float | None
 """JSON-serializable primitive types that work with functions like json.dumps(). Note that dicts and lists may contain
 content that is not JSON-serializable."""
@@ -53,22 +74,163 @@ def extract_json_schema(content: str) -> dict:
     return schema
 
 
+def schema_fingerprint(schema: dict) -> str:
+    """Identifies a schema by its content, so that artifacts with the same structure (e.g., pages of the same search)
+    can be recognized."""
+    canonical = json.dumps(schema, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def local_mounts_from_env() -> dict[str, Path]:
+    """
+    Reads URL prefixes that are also mounted on this host from the MAP_AGENT_LOCAL_MOUNTS environment variable, e.g.
+    "https://storage.example.org/artifacts/=/mnt/artifacts;https://other.example.org/=/mnt/other".
+    """
+    mounts = {}
+    for mapping in os.getenv("MAP_AGENT_LOCAL_MOUNTS", "").split(";"):
+        if mapping.strip():
+            prefix, path = mapping.strip().rsplit("=", 1)
+            mounts[prefix] = Path(path)
+    return mounts
+
+
+def resolve_local_path(uri: str, mounts: dict[str, Path]) -> Optional[Path]:
+    """
+    Returns the local file behind a file:// URI or a URL under a mounted prefix, if there is one. Either way, the file
+    must be inside one of the mounts: artifacts come from outside, and must not be able to point at arbitrary files on
+    this host.
+    """
+    parsed = urllib.parse.urlparse(uri)
+    if parsed.scheme == "file":
+        if parsed.netloc not in ("", "localhost"):
+            return None
+        path = Path(urllib.request.url2pathname(parsed.path)).resolve()
+        if any(path.is_relative_to(root.resolve()) for root in mounts.values()):
+            return path
+        return None
+
+    for prefix, root in mounts.items():
+        if uri.startswith(prefix):
+            relative = urllib.parse.unquote(
+                urllib.parse.urlparse(uri[len(prefix) :]).path
+            )
+            path = (root / relative.lstrip("/")).resolve()
+            # Don't let ".." in the URL escape the mount
+            if path.is_relative_to(root.resolve()):
+                return path
+    return None
+
+
+def read_local_json(
+    path: Path, encoding: str = "identity", budget: MemoryBudget = None
+) -> JSON:
+    """
+    Parses a local JSON file through a memory map. The mapped file is page cache rather than heap, so it is not charged
+    to the budget; only copies made from it are. With orjson installed, the parser reads the mapped pages in place and
+    no copy is made, so files much larger than the budget can be mapped. Without it, the standard library parser needs
+    the file decoded into a string first, which is charged like any other copy. Compressed files are decompressed
+    straight from the map, and only the decompressed content is charged.
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError(f"{path} is empty")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            reader = decoded_reader(mapped, encoding)
+            if reader is not None:
+                with reader:
+                    body = _read_file_within_budget(
+                        reader, budget, "Decoded artifact content"
+                    )
+                if orjson is not None:
+                    return orjson.loads(body)
+                return json.loads(body)
+
+            with memoryview(mapped) as view:
+                if orjson is not None:
+                    return orjson.loads(view)
+                if budget is not None:
+                    budget.check(len(view), "Artifact")
+                    budget.charge(len(view))
+                return json.loads(str(view, "utf-8"))
+
+
+def _read_file_within_budget(
+    file: BinaryIO, budget: Optional[MemoryBudget], what: str
+) -> bytearray:
+    """Reads a file to the end, giving up as soon as it is clear that its content won't fit in the budget."""
+    body = bytearray()
+    while chunk := file.read(READ_CHUNK_SIZE):
+        body += chunk
+        if budget is not None:
+            budget.check(len(body), what)
+    if budget is not None:
+        budget.charge(len(body))
+    return body
+
+
+def _decode_within_budget(
+    body: bytes | bytearray, encoding: str, budget: Optional[MemoryBudget]
+) -> bytes | bytearray:
+    decoded = decode_body(body, encoding)
+    if budget is not None and decoded is not body:
+        budget.check(len(decoded), "Decoded artifact content")
+        budget.charge(len(decoded))
+    return decoded
+
+
 async def retrieve_artifact_content(
-    artifact: Artifact, process: IChatBioAgentProcess
+    artifact: Artifact,
+    process: IChatBioAgentProcess,
+    budget: MemoryBudget = None,
+    deadline: Deadline = None,
 ) -> JSON:
+    encoding = artifact.metadata.get("content_encoding", "identity")
+
+    mounts = local_mounts_from_env()
+    for uri in artifact.uris:
+        path = resolve_local_path(uri, mounts)
+        if path is not None and path.is_file():
+            await process.log("Reading artifact content from a locally mounted file")
+            # Parsing a large file takes a while; keep the event loop free for other requests. Note that a timeout
+            # only stops the wait: a parse that has started runs to completion in its thread, so don't start one
+            # after the deadline has already passed.
+            if deadline is not None and deadline.expired():
+                raise TimeoutError()
+            return await asyncio.to_thread(read_local_json, path, encoding, budget)
+
     async with httpx.AsyncClient(follow_redirects=True) as internet:
         for url in artifact.get_urls():
-            await process.log(
-                f"Retrieving artifact {artifact.local_id} content from {url}"
-            )
-            response = await internet.get(url)
-            if response.is_success:
-                return response.json()  # TODO: catch exception?
-            else:
-                await process.log(
-                    f"Failed to retrieve artifact content: {response.reason_phrase} ({response.status_code})"
-                )
-                raise ValueError()
+            await process.log(f"Retrieving artifact content from {url}")
+            async with internet.stream("GET", url) as response:
+                if response.is_success:
+                    body = await _read_within_budget(response, budget, "Artifact")
+                    if encoding != "identity":
+                        body = _decode_within_budget(body, encoding, budget)
+                    return json.loads(body)  # TODO: catch exception?
+                else:
+                    await process.log(
+                        f"Failed to retrieve artifact content: {response.reason_phrase} ({response.status_code})"
+                    )
+                    raise ValueError()
         else:
             await process.log("Failed to find artifact content")
             raise ValueError()
+
+
+async def _read_within_budget(
+    response: httpx.Response, budget: Optional[MemoryBudget], what: str
+) -> bytearray:
+    """Reads a streamed response body, giving up as soon as it is clear that the body won't fit in the budget."""
+    if budget is None:
+        return bytearray(await response.aread())
+
+    length = response.headers.get("Content-Length")
+    if length is not None:
+        budget.check(int(length), what)
+
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        budget.check(len(body), what)
+    budget.charge(len(body))
+    return body
@@ -34,6 +34,16 @@ class InMemoryResponseChannel(ResponseChannel):
         self.message_buffer.append(message)
 
 
+class RecordingProcess:
+    """Stands in for an IChatBioAgentProcess where only the log messages matter. Records the text of each message."""
+
+    def __init__(self):
+        self.logs = []
+
+    async def log(self, text: str, data: dict = None):
+        self.logs.append(text)
+
+
 TEST_CONTEXT_ID = "617727d1-4ce8-4902-884c-db786854b51c"
 
 
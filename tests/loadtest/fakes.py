@@ -0,0 +1,150 @@
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from plot import PropertyPaths
+
+SYNTHETIC_PROPERTY_PATHS = PropertyPaths(
+    latitude=["records", "geo", "lat"],
+    longitude=["records", "geo", "lon"],
+    color_by=["records", "species"],
+)
+"""The paths to the coordinates in the payloads served by the fake artifact server."""
+
+
+def make_synthetic_artifact(records: int, seed: int = 0) -> bytes:
+    """Generates a search-result-like JSON payload with the given number of records."""
+    rng = random.Random(seed)
+    species = [f"Species {i}" for i in range(20)]
+    content = {
+        "total": records,
+        "records": [
+            {
+                "id": i,
+                "geo": {
+                    "lat": round(rng.uniform(-90, 90), 6),
+                    "lon": round(rng.uniform(-180, 180), 6),
+                },
+                "species": rng.choice(species),
+            }
+            for i in range(records)
+        ],
+    }
+    return json.dumps(content).encode("utf-8")
+
+
+def create_artifact_server(default_records: int = 1000, default_delay: float = 0.0):
+    """
+    Serves synthetic artifacts at /artifacts/{name}. The size and latency of each response can be set with the
+    "records" and "delay" (seconds) query parameters.
+    """
+    payloads: dict[int, bytes] = {}
+
+    async def get_artifact(request: Request):
+        records = int(request.query_params.get("records", default_records))
+        delay = float(request.query_params.get("delay", default_delay))
+        if records not in payloads:
+            payloads[records] = make_synthetic_artifact(records)
+        await asyncio.sleep(delay)
+        return Response(payloads[records], media_type="application/json")
+
+    return Starlette(routes=[Route("/artifacts/{name}", get_artifact)])
+
+
+def create_openai_server(
+    paths: PropertyPaths = SYNTHETIC_PROPERTY_PATHS, delay: float = 0.0
+):
+    """
+    Mimics the OpenAI chat completions endpoint. Every completion calls the requested tool with the given property
+    paths, which is what instructor expects from a successful generation.
+    """
+
+    async def create_chat_completion(request: Request):
+        body = await request.json()
+        await asyncio.sleep(delay)
+
+        tool_name = body["tools"][0]["function"]["name"]
+        arguments = json.dumps({"response": paths.model_dump()})
+        return JSONResponse(
+            {
+                "id": "chatcmpl-loadtest",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "tool_calls",
+                        "message": {
+                            "role": "assistant",
+                            "content": None,
+                            "tool_calls": [
+                                {
+                                    "id": "call_loadtest",
+                                    "type": "function",
+                                    "function": {
+                                        "name": tool_name,
+                                        "arguments": arguments,
+                                    },
+                                }
+                            ],
+                        },
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                },
+            }
+        )
+
+    return Starlette(
+        routes=[Route("/chat/completions", create_chat_completion, methods=["POST"])]
+    )
+
+
+class BackgroundServer:
+    """
+    Runs an ASGI app with uvicorn on a free local port, in a separate thread with its own event loop so that the fake
+    services don't compete with the agent for the event loop being measured.
+
+    Example:
+
+        with BackgroundServer(create_artifact_server()) as server:
+            print(server.url)
+    """
+
+    def __init__(self, app):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        port = self._socket.getsockname()[1]
+
+        self.url = f"http://127.0.0.1:{port}"
+        self._server = uvicorn.Server(
+            uvicorn.Config(app, log_level="warning", lifespan="off")
+        )
+        self._thread = threading.Thread(
+            target=self._server.run, kwargs={"sockets": [self._socket]}, daemon=True
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.should_exit = True
+        self._thread.join()
+        self._socket.close()
@@ -0,0 +1,229 @@
+"""
+Measures agent throughput end to end. The real app from create_app() is driven in-process, while the artifact host
+and the OpenAI API are replaced by local fakes.
+
+Every request is distinct by default, so identical in-flight requests are not coalesced and each one does the full
+work. Use --duplicate-ratio to measure a workload with repeats.
+
+Usage:
+
+    python tests/loadtest/harness.py --requests 200 --concurrency 20 --records 5000
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import httpx
+from pydantic import BaseModel
+
+if __name__ == "__main__":
+    sys.path[:0] = [
+        str(Path(__file__).parents[2] / "src"),
+        str(Path(__file__).parents[1]),
+    ]
+
+import agent
+from loadtest.fakes import (
+    BackgroundServer,
+    create_artifact_server,
+    create_openai_server,
+)
+
+
+class LoadTestReport(BaseModel):
+    requests: int
+    concurrency: int
+    failures: int
+    duration: float
+    """Wall-clock seconds for the whole run."""
+    requests_per_second: float
+    latency_p50: float
+    latency_p90: float
+    latency_p99: float
+    latency_max: float
+    peak_rss_mb: float
+    """Peak resident set size of the whole process, including the fake servers."""
+    loop_lag_p99: float
+    loop_lag_max: float
+    """How late the event loop woke up a periodic timer, in seconds."""
+    duplicate_ratio: float
+    single_flight: dict
+    """How many computations the agent ran, and how many requests joined one already in progress."""
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def request_urls(artifact_url: str, requests: int, duplicate_ratio: float) -> list[str]:
+    """
+    Gives each request its own artifact URL, except for the given fraction of requests, which repeat an earlier
+    URL. The fake artifact host ignores the extra query parameter, so every URL serves the same records.
+    """
+    distinct = max(1, requests - round(requests * duplicate_ratio))
+    url = httpx.URL(artifact_url)
+    return [str(url.copy_add_param("request", i % distinct)) for i in range(requests)]
+
+
+def make_plot_request(artifact_url: str) -> dict:
+    """Builds an A2A "message/send" request for the plot entrypoint."""
+    return {
+        "jsonrpc": "2.0",
+        "id": str(uuid.uuid4()),
+        "method": "message/send",
+        "params": {
+            "message": {
+                "role": "user",
+                "messageId": str(uuid.uuid4()),
+                "parts": [
+                    {"kind": "text", "text": "Map these records colored by species"},
+                    {
+                        "kind": "data",
+                        "data": {
+                            "entrypoint": {
+                                "id": "plot",
+                                "parameters": {
+                                    "artifact": {
+                                        "local_id": "#0000",
+                                        "description": "Synthetic records",
+                                        "mimetype": "application/json",
+                                        "uris": [artifact_url],
+                                        "metadata": {},
+                                    }
+                                },
+                            }
+                        },
+                    },
+                ],
+            }
+        },
+    }
+
+
+def is_completed(response: httpx.Response) -> bool:
+    if not response.is_success:
+        return False
+    result = response.json().get("result", {})
+    return result.get("status", {}).get("state") == "completed"
+
+
+async def monitor_loop_lag(samples: list[float], interval: float = 0.01):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run_load_test(
+    requests: int,
+    concurrency: int,
+    artifact_url: str,
+    timeout: Optional[float] = 120,
+    duplicate_ratio: float = 0.0,
+) -> LoadTestReport:
+    """Fires `requests` plot requests at the app, at most `concurrency` at a time."""
+    map_agent = agent.MapAgent()
+    app = agent.create_app(map_agent)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+    lag_samples = []
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://agent.test",
+        timeout=timeout,
+    ) as client:
+
+        async def send_one(url: str):
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/", json=make_plot_request(url))
+                    completed = is_completed(response)
+                except httpx.HTTPError:
+                    completed = False
+                latencies.append(time.perf_counter() - start)
+                failures += not completed
+
+        monitor = asyncio.create_task(monitor_loop_lag(lag_samples))
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                send_one(url)
+                for url in request_urls(artifact_url, requests, duplicate_ratio)
+            )
+        )
+        duration = time.perf_counter() - start
+        monitor.cancel()
+
+    latencies.sort()
+    lag_samples.sort()
+    return LoadTestReport(
+        requests=requests,
+        concurrency=concurrency,
+        failures=failures,
+        duration=duration,
+        requests_per_second=requests / duration if duration else 0.0,
+        latency_p50=percentile(latencies, 0.50),
+        latency_p90=percentile(latencies, 0.90),
+        latency_p99=percentile(latencies, 0.99),
+        latency_max=latencies[-1] if latencies else 0.0,
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        loop_lag_p99=percentile(lag_samples, 0.99),
+        loop_lag_max=lag_samples[-1] if lag_samples else 0.0,
+        duplicate_ratio=duplicate_ratio,
+        single_flight=map_agent.single_flight.stats(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--records", type=int, default=1000, help="Records per artifact"
+    )
+    parser.add_argument("--artifact-delay", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="Seconds")
+    parser.add_argument(
+        "--duplicate-ratio",
+        type=float,
+        default=0.0,
+        help="Fraction of requests that repeat an earlier request",
+    )
+    args = parser.parse_args()
+
+    with (
+        BackgroundServer(
+            create_artifact_server(args.records, args.artifact_delay)
+        ) as artifacts,
+        BackgroundServer(create_openai_server(delay=args.llm_delay)) as openai,
+    ):
+        os.environ["OPENAI_BASE_URL"] = openai.url
+        os.environ["OPENAI_API_KEY"] = "loadtest"
+        report = asyncio.run(
+            run_load_test(
+                args.requests,
+                args.concurrency,
+                f"{artifacts.url}/artifacts/synthetic",
+                duplicate_ratio=args.duplicate_ratio,
+            )
+        )
+
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
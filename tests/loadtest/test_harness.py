@@ -0,0 +1,42 @@
+import pytest
+
+from loadtest.fakes import (
+    BackgroundServer,
+    create_artifact_server,
+    create_openai_server,
+)
+from loadtest.harness import request_urls, run_load_test
+
+
+@pytest.mark.asyncio
+async def test_load_test_harness(monkeypatch):
+    with (
+        BackgroundServer(create_artifact_server(default_records=50)) as artifacts,
+        BackgroundServer(create_openai_server(delay=0.01)) as openai,
+    ):
+        monkeypatch.setenv("OPENAI_BASE_URL", openai.url)
+        monkeypatch.setenv("OPENAI_API_KEY", "loadtest")
+
+        report = await run_load_test(
+            requests=8,
+            concurrency=4,
+            artifact_url=f"{artifacts.url}/artifacts/synthetic?delay=0.01",
+        )
+
+    assert report.failures == 0
+    assert report.requests_per_second > 0
+    assert 0 < report.latency_p50 <= report.latency_p99 <= report.latency_max
+    assert report.peak_rss_mb > 0
+    # Distinct requests are never coalesced, so each one is measured doing the full work
+    assert report.single_flight == {"computations": 8, "hits": 0}
+
+
+def test_request_urls():
+    urls = request_urls("http://artifacts.test/a?delay=0.01", 4, duplicate_ratio=0.5)
+
+    assert urls == [
+        "http://artifacts.test/a?delay=0.01&request=0",
+        "http://artifacts.test/a?delay=0.01&request=1",
+        "http://artifacts.test/a?delay=0.01&request=0",
+        "http://artifacts.test/a?delay=0.01&request=1",
+    ]
@@ -1,6 +1,12 @@
+import asyncio
+import gzip
+import json
+from unittest.mock import ANY
+
 import ichatbio.types
 import pytest
 from ichatbio.agent_response import (
+    ResponseContext,
     ArtifactResponse,
     ProcessBeginResponse,
     ProcessLogResponse,
@@ -8,8 +14,11 @@ from ichatbio.agent_response import (
 )
 
 import agent
-from conftest import resource
-from src.agent import MapAgent
+from conftest import resource, InMemoryResponseChannel, TEST_CONTEXT_ID
+from deadline import Deadline
+from plot import PropertyPaths
+from spatial import BoundingBox
+from util import extract_json_schema, schema_fingerprint
 
 
 @pytest.mark.httpx_mock(
@@ -20,7 +29,7 @@ async def test_make_geojson(context, messages, httpx_mock):
     content = resource("buried_list_of_lat_lons.json")
     httpx_mock.add_response(url="https://artifact.test", text=content)
 
-    await MapAgent().run(
+    await agent.MapAgent().run(
         context,
         "Get points colored by size",
         "plot",
@@ -42,7 +51,7 @@ async def test_make_geojson(context, messages, httpx_mock):
     assert messages == [
         ProcessBeginResponse(summary="Creating map data", data=None),
         ProcessLogResponse(
-            text="Retrieving artifact #0000 content from https://artifact.test",
+            text="Retrieving artifact content from https://artifact.test",
             data=None,
         ),
         ProcessLogResponse(
@@ -53,11 +62,627 @@ async def test_make_geojson(context, messages, httpx_mock):
                 "color_by": ["points", "size"],
             },
         ),
+        ProcessLogResponse(
+            text="Parsed coordinate values",
+            data={"parsed": 6, "repaired": 0, "rejected": 0, "missing": 0},
+        ),
+        ProcessLogResponse(
+            text="Encoded map data",
+            data={
+                "points": 3,
+                "precision": 6,
+                "encoding": "identity",
+                "unquantized_json_bytes": 395,
+                "json_bytes": 395,
+                "encoded_bytes": 395,
+                "unquantized_json_bytes_per_point": 395 / 3,
+                "json_bytes_per_point": 395 / 3,
+                "encoded_bytes_per_point": 395 / 3,
+            },
+        ),
         ArtifactResponse(
             mimetype="application/json",
             description="GeoJSON points extracted from artifact #0000",
             uris=None,
-            content=b'{"type": "FeatureCollection", "features": [{"type": "Feature", "id": 0, "geometry": {"type": "Point", "coordinates": [10.7, 53.1]}, "properties": {"value": 1.0}}, {"type": "Feature", "id": 1, "geometry": {"type": "Point", "coordinates": [5.5, 3.3]}, "properties": {"value": 2.0}}, {"type": "Feature", "id": 2, "geometry": {"type": "Point", "coordinates": [70.0, 59.5]}, "properties": {"value": 3.0}}]}',
-            metadata={"format": "geojson"},
+            content=b'{"type": "FeatureCollection", "features": [{"type": "Feature", "id": 0, "geometry": {"type": "Point", "coordinates": [10.7, 53.1]}, "properties": {"value": 0}}, {"type": "Feature", "id": 1, "geometry": {"type": "Point", "coordinates": [5.5, 3.3]}, "properties": {"value": 1}}, {"type": "Feature", "id": 2, "geometry": {"type": "Point", "coordinates": [70.0, 59.5]}, "properties": {"value": 2}}]}',
+            metadata={
+                "format": "geojson",
+                "schema_fingerprint": schema_fingerprint(
+                    extract_json_schema(json.loads(content))
+                ),
+                "property_paths": {
+                    "latitude": ["points", "latitude"],
+                    "longitude": ["points", "longitude"],
+                    "color_by": ["points", "size"],
+                },
+                "next_feature_id": 3,
+                "legend": {
+                    "type": "quantile",
+                    "entries": [
+                        {
+                            "code": 0,
+                            "color": "#fef0d9",
+                            "count": 1,
+                            "min": 1.0,
+                            "max": 1.0,
+                        },
+                        {
+                            "code": 1,
+                            "color": "#fc8d59",
+                            "count": 1,
+                            "min": 2.0,
+                            "max": 2.0,
+                        },
+                        {
+                            "code": 2,
+                            "color": "#b30000",
+                            "count": 1,
+                            "min": 3.0,
+                            "max": 3.0,
+                        },
+                    ],
+                    "edges": [1.6666666666666667, 2.3333333333333335],
+                },
+            },
+        ),
+        ProcessLogResponse(
+            text="Uploaded map data",
+            data={"encode_seconds": ANY, "upload_seconds": ANY},
+        ),
+    ]
+
+
+def stub_select_properties(monkeypatch, paths: PropertyPaths):
+    """Stands in for the LLM, which always selects the given paths."""
+
+    async def select_properties(request, schema, deadline=None):
+        return paths
+
+    monkeypatch.setattr(agent, "select_properties", select_properties)
+
+
+@pytest.fixture
+def selected_paths(monkeypatch):
+    """Lets tests build fresh maps of buried_list_of_lat_lons.json without the LLM."""
+    stub_select_properties(
+        monkeypatch,
+        PropertyPaths(
+            latitude=["points", "latitude"], longitude=["points", "longitude"]
+        ),
+    )
+
+
+def get_artifact(messages: list[ResponseMessage]) -> ArtifactResponse:
+    return next(m for m in messages if isinstance(m, ArtifactResponse))
+
+
+def make_previous_map(content: str, next_feature_id: int) -> ichatbio.types.Artifact:
+    return ichatbio.types.Artifact(
+        local_id="#0001",
+        description="na",
+        mimetype="application/json",
+        uris=["https://map.test"],
+        metadata={
+            "format": "geojson",
+            "schema_fingerprint": schema_fingerprint(
+                extract_json_schema(json.loads(content))
+            ),
+            "property_paths": {
+                "latitude": ["points", "latitude"],
+                "longitude": ["points", "longitude"],
+                "color_by": None,
+            },
+            "next_feature_id": next_feature_id,
+        },
+    )
+
+
+PREVIOUS_MAP = {
+    "type": "FeatureCollection",
+    "features": [
+        {
+            "type": "Feature",
+            "id": 0,
+            "geometry": {"type": "Point", "coordinates": [1.0, 2.0]},
+            "properties": {"value": 1.0},
+        }
+    ],
+}
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url.host in ("artifact.test", "map.test")
+)
+@pytest.mark.asyncio
+async def test_append_to_previous_map(context, messages, httpx_mock):
+    content = resource("buried_list_of_lat_lons.json")
+    httpx_mock.add_response(url="https://artifact.test", text=content)
+    httpx_mock.add_response(url="https://map.test", json=PREVIOUS_MAP)
+
+    await agent.MapAgent().run(
+        context,
+        "Get points",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
+            previous_map=make_previous_map(content, next_feature_id=1),
+        ),
+    )
+
+    assert messages[2] == ProcessLogResponse(
+        text="Reusing property paths from the previous map", data=None
+    )
+
+    artifact = get_artifact(messages)
+    assert artifact.description == (
+        "GeoJSON points extracted from artifact #0002, appended to map #0001"
+    )
+    assert artifact.metadata["next_feature_id"] == 4
+
+    geo = json.loads(artifact.content)
+    assert [feature["id"] for feature in geo["features"]] == [0, 1, 2, 3]
+    assert geo["features"][1]["geometry"]["coordinates"] == [10.7, 53.1]
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_no_append_across_coordinate_transforms(
+    context, messages, httpx_mock, monkeypatch
+):
+    monkeypatch.setenv("MAP_AGENT_INTEGER_COORDINATES", "1")
+    content = resource("buried_list_of_lat_lons.json")
+    httpx_mock.add_response(url="https://artifact.test", text=content)
+
+    await agent.MapAgent().run(
+        context,
+        "Get points",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
+            previous_map=make_previous_map(content, next_feature_id=1),
+        ),
+    )
+
+    assert (
+        ProcessLogResponse(
+            text="Previous map stores coordinates differently; continuing it instead of appending to it",
+            data=None,
+        )
+        in messages
+    )
+    artifact = get_artifact(messages)
+    assert artifact.metadata["delta_of"] == "#0001"
+    assert [f["id"] for f in json.loads(artifact.content)["features"]] == [1, 2, 3]
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_delta_of_previous_map(context, messages, httpx_mock):
+    content = resource("buried_list_of_lat_lons.json")
+    httpx_mock.add_response(url="https://artifact.test", text=content)
+
+    await agent.MapAgent().run(
+        context,
+        "Get points",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
+            previous_map=make_previous_map(content, next_feature_id=10),
+            incremental_output="delta",
+        ),
+    )
+
+    artifact = get_artifact(messages)
+    assert artifact.metadata["delta_of"] == "#0001"
+    assert artifact.metadata["next_feature_id"] == 13
+
+    geo = json.loads(artifact.content)
+    assert [feature["id"] for feature in geo["features"]] == [10, 11, 12]
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_spill_when_over_memory_budget(
+    selected_paths, context, messages, httpx_mock, monkeypatch
+):
+    # Enough for the 268-byte artifact, but not for the coordinates on top of it
+    monkeypatch.setenv("MAP_AGENT_MEMORY_BUDGET_MB", "0.0003")
+    content = resource("buried_list_of_lat_lons.json")
+    httpx_mock.add_response(url="https://artifact.test", text=content)
+
+    await agent.MapAgent().run(
+        context,
+        "Get points",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
+        ),
+    )
+
+    assert (
+        ProcessLogResponse(
+            text="Memory budget exceeded; spilled intermediate data to disk",
+            data={"budget": 314, "spilled": ["coordinates", "output"]},
+        )
+        in messages
+    )
+
+    geo = json.loads(get_artifact(messages).content)
+    assert [feature["geometry"]["coordinates"] for feature in geo["features"]] == [
+        [10.7, 53.1],
+        [5.5, 3.3],
+        [70.0, 59.5],
+    ]
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_reject_artifact_larger_than_memory_budget(
+    context, messages, httpx_mock, monkeypatch
+):
+    monkeypatch.setenv("MAP_AGENT_MEMORY_BUDGET_MB", "0.0001")
+    content = resource("buried_list_of_lat_lons.json")
+    httpx_mock.add_response(url="https://artifact.test", text=content)
+
+    await agent.MapAgent().run(
+        context,
+        "Get points",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
+        ),
+    )
+
+    assert messages[-1] == ProcessLogResponse(
+        text="Artifact is too large to map: Artifact (268 bytes) does not fit in the memory budget (104 of 104 "
+        "bytes left)",
+        data=None,
+    )
+    assert not any(isinstance(m, ArtifactResponse) for m in messages)
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_compressed_integer_output(
+    selected_paths, context, messages, httpx_mock, monkeypatch
+):
+    monkeypatch.setenv("MAP_AGENT_CONTENT_ENCODING", "gzip")
+    monkeypatch.setenv("MAP_AGENT_INTEGER_COORDINATES", "1")
+    monkeypatch.setenv("MAP_AGENT_COORDINATE_PRECISION", "2")
+    content = resource("buried_list_of_lat_lons.json")
+    httpx_mock.add_response(url="https://artifact.test", text=content)
+
+    await agent.MapAgent().run(
+        context,
+        "Get points",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
+        ),
+    )
+
+    artifact = get_artifact(messages)
+    assert artifact.metadata["content_encoding"] == "gzip"
+    assert artifact.metadata["transform"] == {
+        "scale": [0.01, 0.01],
+        "translate": [-180, -90],
+    }
+
+    geo = json.loads(gzip.decompress(artifact.content))
+    assert geo["features"][0]["geometry"]["coordinates"] == [19070, 14310]
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_filter_by_region(selected_paths, context, messages, httpx_mock):
+    content = resource("buried_list_of_lat_lons.json")
+    httpx_mock.add_response(url="https://artifact.test", text=content)
+
+    await agent.MapAgent().run(
+        context,
+        "Get points in Europe",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
+            region=BoundingBox(west=-25, south=34, east=45, north=72),
+        ),
+    )
+
+    assert (
+        ProcessLogResponse(
+            text="Filtered points by region",
+            data={
+                "inside": 1,
+                "outside": 2,
+                "missing": 0,
+                "grid_decided": 3,
+                "exact_tests": 0,
+            },
+        )
+        in messages
+    )
+
+    geo = json.loads(get_artifact(messages).content)
+    assert [feature["id"] for feature in geo["features"]] == [0]
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_legend_only_describes_mapped_points(
+    context, messages, httpx_mock, monkeypatch
+):
+    stub_select_properties(
+        monkeypatch,
+        PropertyPaths(
+            latitude=["points", "latitude"],
+            longitude=["points", "longitude"],
+            color_by=["points", "kind"],
+        ),
+    )
+    content = {
+        "points": [
+            {"latitude": 53.1, "longitude": 10.7, "kind": "a"},
+            {"latitude": 3.3, "longitude": 5.5, "kind": "b"},
+            {"latitude": None, "longitude": 70.0, "kind": "b"},
+            {"latitude": 59.5, "longitude": 70.0, "kind": "c"},
+        ]
+    }
+    httpx_mock.add_response(url="https://artifact.test", json=content)
+
+    await agent.MapAgent().run(
+        context,
+        "Get points in Europe colored by kind",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
+            region=BoundingBox(west=-25, south=34, east=45, north=72),
+        ),
+    )
+
+    artifact = get_artifact(messages)
+    assert artifact.metadata["legend"]["entries"] == [
+        {"code": 0, "color": "#4e79a7", "count": 1, "value": "a"}
+    ]
+    geo = json.loads(artifact.content)
+    assert [feature["properties"] for feature in geo["features"]] == [{"value": 0}]
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_coalesce_duplicate_requests(selected_paths, httpx_mock):
+    content = resource("buried_list_of_lat_lons.json")
+    httpx_mock.add_response(url="https://artifact.test", text=content)
+
+    map_agent = agent.MapAgent()
+    conversations = [list(), list()]
+
+    async def run(messages, local_id, request):
+        await map_agent.run(
+            ResponseContext(InMemoryResponseChannel(messages), TEST_CONTEXT_ID),
+            request,
+            "plot",
+            agent.Parameters(
+                artifact=ichatbio.types.Artifact(
+                    local_id=local_id,
+                    description="na",
+                    mimetype="na",
+                    uris=["https://artifact.test"],
+                    metadata={},
+                ),
+            ),
+        )
+
+    await asyncio.gather(
+        run(conversations[0], "#000a", "Get points"),
+        run(conversations[1], "#000b", "  get   POINTS "),
+    )
+
+    assert len(httpx_mock.get_requests()) == 1
+    assert map_agent.single_flight.stats() == {"computations": 1, "hits": 1}
+
+    # Neither conversation hears about the other's artifact IDs
+    for messages, other_id in zip(conversations, ("#000b", "#000a")):
+        assert not any(other_id in str(message) for message in messages)
+
+    first, second = (get_artifact(messages) for messages in conversations)
+    assert first.content == second.content
+    assert first.description.startswith("GeoJSON points extracted from artifact #000a")
+    assert second.description.startswith("GeoJSON points extracted from artifact #000b")
+    assert (
+        ProcessLogResponse(
+            text="Joined an identical request that is already in progress",
+            data={"computations": 1, "hits": 1},
+        )
+        in conversations[1]
+    )
+
+
+def expires_during(expiring_stage: str, after: int = 2) -> type[Deadline]:
+    """Makes a Deadline that runs out after `after` items of the given stage."""
+
+    class ExpiringDeadline(Deadline):
+        def limit(self, items, stage, every=1024):
+            if stage != expiring_stage:
+                yield from super().limit(items, stage, every)
+                return
+            for i, item in enumerate(items):
+                if i == after:
+                    self.interrupt(stage)
+                    return
+                yield item
+
+    return ExpiringDeadline
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_partial_map_when_out_of_time(
+    selected_paths, context, messages, httpx_mock, monkeypatch
+):
+    monkeypatch.setattr(agent, "Deadline", expires_during("rendering points"))
+    content = resource("buried_list_of_lat_lons.json")
+    httpx_mock.add_response(url="https://artifact.test", text=content)
+
+    await agent.MapAgent().run(
+        context,
+        "Get points",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
         ),
+    )
+
+    note = "Ran out of time while rendering points; the map only includes the 2 points processed so far"
+    assert ProcessLogResponse(text=note, data=None) in messages
+
+    artifact = get_artifact(messages)
+    assert artifact.description.endswith("(partial)")
+    assert artifact.metadata["partial"] is True
+    assert artifact.metadata["note"] == note
+    assert artifact.metadata["next_feature_id"] == 2
+    assert len(json.loads(artifact.content)["features"]) == 2
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_partial_map_when_extraction_runs_out_of_time(
+    selected_paths, context, messages, httpx_mock, monkeypatch
+):
+    monkeypatch.setattr(agent, "Deadline", expires_during("reading coordinates"))
+    content = resource("buried_list_of_lat_lons.json")
+    httpx_mock.add_response(url="https://artifact.test", text=content)
+
+    await agent.MapAgent().run(
+        context,
+        "Get points",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
+        ),
+    )
+
+    note = "Ran out of time while reading coordinates; the map only includes the 2 points processed so far"
+    assert ProcessLogResponse(text=note, data=None) in messages
+
+    artifact = get_artifact(messages)
+    assert artifact.metadata["next_feature_id"] == 2
+    geo = json.loads(artifact.content)
+    assert [feature["geometry"]["coordinates"] for feature in geo["features"]] == [
+        [10.7, 53.1],
+        [5.5, 3.3],
     ]
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_no_map_when_retrieval_runs_out_of_time(
+    context, messages, httpx_mock, monkeypatch
+):
+    monkeypatch.setenv("MAP_AGENT_TIME_BUDGET_SECONDS", "0.05")
+
+    async def stall(request):
+        await asyncio.sleep(60)
+
+    httpx_mock.add_callback(stall, url="https://artifact.test")
+
+    await agent.MapAgent().run(
+        context,
+        "Get points",
+        "plot",
+        agent.Parameters(
+            artifact=ichatbio.types.Artifact(
+                local_id="#0002",
+                description="na",
+                mimetype="na",
+                uris=["https://artifact.test"],
+                metadata={},
+            ),
+        ),
+    )
+
+    assert messages[-1] == ProcessLogResponse(
+        text="Ran out of time while retrieving the artifact content", data=None
+    )
+    assert not any(isinstance(m, ArtifactResponse) for m in messages)
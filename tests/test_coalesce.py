@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from coalesce import SingleFlight
+from conftest import RecordingProcess
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_share_one_computation():
+    flights = SingleFlight()
+    started = asyncio.Event()
+    release = asyncio.Event()
+    calls = 0
+
+    async def compute(shared):
+        nonlocal calls
+        calls += 1
+        await shared.log("first")
+        started.set()
+        await release.wait()
+        await shared.log("second")
+        return "result"
+
+    leader, follower = RecordingProcess(), RecordingProcess()
+    leader_task = asyncio.create_task(flights.run("key", compute, leader))
+    await started.wait()
+    follower_task = asyncio.create_task(flights.run("key", compute, follower))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(leader_task, follower_task) == ["result", "result"]
+    assert calls == 1
+    assert flights.stats() == {"computations": 1, "hits": 1}
+    assert leader.logs == ["first", "second"]
+    assert follower.logs == [
+        "Joined an identical request that is already in progress",
+        "first",
+        "second",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_finished_computations_are_not_reused():
+    flights = SingleFlight()
+
+    async def compute(shared):
+        return object()
+
+    first = await flights.run("key", compute, RecordingProcess())
+    second = await flights.run("key", compute, RecordingProcess())
+
+    assert first is not second
+    assert flights.stats() == {"computations": 2, "hits": 0}
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_caller():
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def compute(shared):
+        await release.wait()
+        raise ValueError("no content")
+
+    tasks = [
+        asyncio.create_task(flights.run("key", compute, RecordingProcess()))
+        for _ in range(3)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flights.stats() == {"computations": 1, "hits": 2}
+
+
+class DisconnectedProcess(RecordingProcess):
+    async def log(self, text: str, data: dict = None):
+        if self.logs:
+            raise ConnectionError("caller went away")
+        await super().log(text, data)
+
+
+@pytest.mark.asyncio
+async def test_failing_subscriber_does_not_fail_the_others():
+    flights = SingleFlight()
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def compute(shared):
+        started.set()
+        await release.wait()
+        await shared.log("progress")
+        await shared.log("done")
+        return "result"
+
+    healthy, disconnected = RecordingProcess(), DisconnectedProcess()
+    healthy_task = asyncio.create_task(flights.run("key", compute, healthy))
+    await started.wait()
+    disconnected_task = asyncio.create_task(flights.run("key", compute, disconnected))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await healthy_task == "result"
+    assert healthy.logs == ["progress", "done"]
+    # Only the joining message got through before the caller went away
+    assert disconnected.logs == [
+        "Joined an identical request that is already in progress"
+    ]
+    assert await disconnected_task == "result"
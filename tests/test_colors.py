@@ -0,0 +1,114 @@
+from colors import (
+    Legend,
+    LegendEntry,
+    OTHER_COLOR,
+    PALETTE,
+    bin_quantiles,
+    encode_categories,
+    encode_color_values,
+)
+
+
+def test_encode_categories():
+    codes, legend = encode_categories(
+        ["Puma concolor", "Lynx rufus", None, "Lynx rufus"]
+    )
+
+    assert codes == [1, 0, None, 0]
+    assert legend == Legend(
+        type="categorical",
+        entries=[
+            LegendEntry(code=0, color=PALETTE[0], count=2, value="Lynx rufus"),
+            LegendEntry(code=1, color=PALETTE[1], count=1, value="Puma concolor"),
+        ],
+    )
+
+
+def test_encode_categories_extends_previous_legend():
+    _, previous = encode_categories(["Puma concolor"])
+
+    codes, legend = encode_categories(
+        ["Lynx rufus", "Puma concolor"], previous=previous
+    )
+
+    assert codes == [1, 0]
+    assert [(entry.value, entry.count) for entry in legend.entries] == [
+        ("Puma concolor", 2),
+        ("Lynx rufus", 1),
+    ]
+
+
+def test_bin_quantiles():
+    values = [float(v) for v in range(10)] + [None]
+
+    codes, legend = bin_quantiles(values, bins=5)
+
+    assert codes == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4, None]
+    assert [entry.count for entry in legend.entries] == [2, 2, 2, 2, 2]
+    assert [(entry.min, entry.max) for entry in legend.entries][0] == (0.0, 1.0)
+    assert len(legend.edges) == 4
+
+
+def test_bin_quantiles_with_few_distinct_values():
+    codes, legend = bin_quantiles([5.0, 5.0, 5.0], bins=5)
+
+    assert codes == [0, 0, 0]
+    assert legend.edges == []
+    assert len(legend.entries) == 1
+
+
+def test_bin_quantiles_reuses_previous_edges():
+    _, previous = bin_quantiles([0.0, 10.0], bins=2)
+
+    codes, legend = bin_quantiles([-100.0, 4.0, 6.0, 100.0], previous=previous)
+
+    assert legend.edges == previous.edges
+    assert codes == [0, 0, 1, 1]
+    assert legend.entries[0].min == -100.0
+    assert legend.entries[1].max == 100.0
+    assert [entry.count for entry in legend.entries] == [3, 3]
+
+
+def test_encode_color_values_detects_type():
+    _, legend = encode_color_values(["1", 2, 3.5, None])
+    assert legend.type == "quantile"
+
+    _, legend = encode_color_values(["Puma concolor", 2, None])
+    assert legend.type == "categorical"
+
+    codes, legend = encode_color_values([True, False, True])
+    assert legend.type == "categorical"
+    assert codes == [0, 1, 0]
+
+
+def test_encode_categories_caps_the_legend():
+    values = [f"record {i}" for i in range(100)] + ["common"] * 5 + [None]
+
+    codes, legend = encode_categories(values, max_categories=3)
+
+    assert len(legend.entries) == 4
+    assert legend.other_code == 3
+    assert legend.entries[0].value == "common"
+    assert legend.entries[3] == LegendEntry(code=3, color=OTHER_COLOR, count=98)
+    assert codes[-6:] == [0, 0, 0, 0, 0, None]
+    assert codes.count(3) == 98
+
+
+def test_encode_categories_keeps_other_code_across_pages():
+    _, previous = encode_categories(["a", "b", "c", "d"], max_categories=2)
+
+    codes, legend = encode_categories(
+        ["a", "e", "d"], previous=previous, max_categories=2
+    )
+
+    assert codes == [0, 2, 2]
+    assert len(legend.entries) == 3
+    assert legend.entries[2].count == 4
+
+
+def test_encode_categories_tells_bools_from_numbers():
+    codes, legend = encode_categories([True, 1, 1, False, 0, 0, 0])
+
+    assert codes == [2, 1, 1, 3, 0, 0, 0]
+    assert [entry.value for entry in legend.entries] == [0, 1, True, False]
+    assert [type(entry.value) for entry in legend.entries] == [int, int, bool, bool]
@@ -0,0 +1,93 @@
+import pytest
+
+from coordinates import (
+    ParseReport,
+    parse_coordinates,
+    parse_coordinate_pairs,
+    parse_dms,
+    split_coordinate_pair,
+)
+
+
+@pytest.mark.parametrize(
+    "value,axis,expected",
+    [
+        ("40°05'N", "latitude", 40 + 5 / 60),
+        ("40°05'S", "latitude", -(40 + 5 / 60)),
+        ("-99.225 W", "longitude", -99.225),
+        ("99.225W", "longitude", -99.225),
+        ("W 99.225", "longitude", -99.225),
+        ("12°30'36\" S", "latitude", -12.51),
+        ("12 30 36 S", "latitude", -12.51),
+        ("12:30:36", "latitude", 12.51),
+        ("23,075", "latitude", 23.075),
+    ],
+)
+def test_parse_dms(value, axis, expected):
+    assert parse_dms(value, axis) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize(
+    "value,axis",
+    [
+        ("40°05'E", "latitude"),
+        ("99°13'N", "longitude"),
+        ("N 40 S", "latitude"),
+        ("40°75'N", "latitude"),
+        ("somewhere", "latitude"),
+    ],
+)
+def test_parse_dms_rejects_invalid_values(value, axis):
+    assert parse_dms(value, axis) is None
+
+
+def test_parse_coordinates():
+    values = [23.075, "23.1083333", "40°05'N", None, "", "unknown", 95, True, "nan"]
+
+    coordinates, report = parse_coordinates(values, "latitude")
+
+    assert coordinates == [
+        23.075,
+        23.1083333,
+        pytest.approx(40 + 5 / 60),
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+    ]
+    assert report == ParseReport(parsed=3, repaired=1, rejected=4, missing=2)
+
+
+def test_parse_coordinates_checks_axis_range():
+    coordinates, report = parse_coordinates([120, -181, "-179.5"], "longitude")
+
+    assert coordinates == [120.0, None, -179.5]
+    assert report == ParseReport(parsed=2, repaired=0, rejected=1, missing=0)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("23.07, -99.22", ("23.07", "-99.22")),
+        ("23.07;-99.22", ("23.07", "-99.22")),
+        ("23.07 -99.22", ("23.07", "-99.22")),
+        ("40°05'N 99°13'W", ("40°05'N", "99°13'W")),
+        ([23.07, -99.22], (None, None)),
+        ("23.07", (None, None)),
+        (None, (None, None)),
+    ],
+)
+def test_split_coordinate_pair(value, expected):
+    assert split_coordinate_pair(value) == expected
+
+
+def test_parse_coordinate_pairs():
+    latitudes, longitudes, report = parse_coordinate_pairs(
+        ["23.07, -99.22", "40°05'N, 99°13'W", None, "nowhere"]
+    )
+
+    assert latitudes == [23.07, pytest.approx(40 + 5 / 60), None, None]
+    assert longitudes == [-99.22, pytest.approx(-(99 + 13 / 60)), None, None]
+    assert report == ParseReport(parsed=4, repaired=2, rejected=2, missing=2)
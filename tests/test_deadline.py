@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+
+from conftest import resource
+from deadline import Deadline, time_budget_from_env
+from plot import PropertyPaths, read_coordinates, select_properties
+from util import extract_json_schema
+
+
+def test_no_deadline():
+    deadline = Deadline(None)
+
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert list(deadline.limit(range(5000), "counting")) == list(range(5000))
+    assert deadline.interrupted is None
+
+
+def test_limit_stops_when_expired():
+    deadline = Deadline(0)
+
+    assert deadline.expired()
+    assert list(deadline.limit(range(5000), "counting")) == []
+    assert deadline.interrupted == "counting"
+
+
+def test_limit_checks_periodically():
+    deadline = Deadline(60)
+
+    def items():
+        for i in range(100):
+            if i == 10:
+                deadline.expires_at = 0
+            yield i
+
+    assert list(deadline.limit(items(), "counting", every=8)) == list(range(16))
+
+
+def test_time_budget_from_env(monkeypatch):
+    monkeypatch.setenv("MAP_AGENT_TIME_BUDGET_SECONDS", "none")
+    assert time_budget_from_env() is None
+
+    monkeypatch.setenv("MAP_AGENT_TIME_BUDGET_SECONDS", "2.5")
+    assert time_budget_from_env() == 2.5
+
+
+def test_read_coordinates_keeps_columns_aligned():
+    paths = PropertyPaths(latitude=["lat"], longitude=["lon"])
+    deadline = Deadline(60)
+
+    class Records(list):
+        """Expires the deadline as soon as record 2048 is read."""
+
+        def __iter__(self):
+            for i, record in enumerate(super().__iter__()):
+                if i == 2048:
+                    deadline.expires_at = 0
+                yield record
+
+    data = Records({"lat": i % 90, "lon": i % 180} for i in range(5000))
+    lats, lons, report = read_coordinates(data, paths, deadline)
+
+    assert len(lats) == len(lons) == 2048
+    assert list(zip(lats, lons)) == [(i % 90, i % 180) for i in range(2048)]
+    assert report.parsed == 2 * 2048
+    assert deadline.interrupted == "reading coordinates"
+
+
+@pytest.mark.asyncio
+async def test_select_properties_gives_up_when_out_of_time(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "unused")
+    schema = extract_json_schema(json.loads(resource("list_of_lat_lons.json")))
+
+    async def hang(*args, **kwargs):
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr("openai.resources.chat.AsyncCompletions.create", hang)
+    deadline = Deadline(0.05)
+
+    response = await select_properties("Map the points", schema, deadline)
+
+    assert response.reason == "Ran out of time while choosing property paths"
+    assert deadline.interrupted == "selecting property paths"
@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+from memory import (
+    MemoryBudget,
+    MemoryBudgetExceeded,
+    FloatColumn,
+    SpillBuffer,
+    write_feature_collection,
+    write_json,
+)
+
+
+def test_column_fits_in_budget():
+    budget = MemoryBudget(limit=1024)
+    column = FloatColumn([1.5, None, -3.0], budget, "latitudes")
+
+    assert not column.spilled
+    assert list(column) == [1.5, None, -3.0]
+    assert budget.used == 24
+    assert budget.spilled == []
+
+
+def test_column_spills_to_disk():
+    budget = MemoryBudget(limit=16)
+    column = FloatColumn([1.5, None, -3.0], budget, "latitudes")
+
+    assert column.spilled
+    assert list(column) == [1.5, None, -3.0]
+    assert column[1:] == [None, -3.0]
+    assert len(column) == 3
+    assert budget.used == 0
+    assert budget.spilled == ["latitudes"]
+
+    column.close()
+
+
+def test_column_spills_while_it_is_built():
+    budget = MemoryBudget(limit=1024)
+    spilled_at = []
+
+    def pairs():
+        for i in range(100):
+            if budget.spilled and not spilled_at:
+                spilled_at.append(i)
+            yield float(i), None if i % 2 else -float(i)
+
+    FloatColumn.CHUNK_SIZE = 16
+    try:
+        column = FloatColumn(pairs(), budget, "coordinates", width=2)
+    finally:
+        FloatColumn.CHUNK_SIZE = 8192
+
+    # 1024 bytes hold 64 pairs, so the column moves to disk with the chunk after that, before it is complete
+    assert spilled_at == [72]
+    assert column.spilled
+    assert len(column) == 100
+    assert column[3] == (3.0, None)
+    assert column[-1] == (99.0, None)
+    assert list(column)[:2] == [(0.0, -0.0), (1.0, None)]
+    assert budget.used == 0
+
+    column.close()
+
+
+def test_check_budget():
+    budget = MemoryBudget(limit=100)
+    budget.charge(60)
+
+    budget.check(40, "Artifact")
+    with pytest.raises(MemoryBudgetExceeded):
+        budget.check(41, "Artifact")
+
+
+def test_buffer_spills_to_disk():
+    budget = MemoryBudget(limit=8)
+    buffer = SpillBuffer(budget, "output")
+
+    buffer.write(b"12345")
+    assert not buffer.spilled
+    assert budget.used == 5
+
+    buffer.write(b"67890")
+    assert buffer.spilled
+    assert budget.used == 0
+    assert budget.spilled == ["output"]
+
+    buffer.write(b"!")
+    assert buffer.getvalue() == b"1234567890!"
+
+    buffer.close()
+
+
+def test_write_json_matches_json_dumps():
+    content = {"features": [{"id": i, "value": i / 3} for i in range(1000)]}
+    buffer = SpillBuffer(MemoryBudget(limit=1024), "output")
+
+    write_json(content, buffer, chunk_size=100)
+
+    assert buffer.spilled
+    assert buffer.getvalue() == json.dumps(content).encode("utf-8")
+
+
+def test_write_feature_collection_matches_json_dumps():
+    features = [{"type": "Feature", "id": i} for i in range(100)]
+    buffer = SpillBuffer(MemoryBudget(limit=1024), "output")
+
+    count, written = write_feature_collection(iter(features), buffer, chunk_size=100)
+
+    expected = json.dumps({"type": "FeatureCollection", "features": features})
+    assert buffer.getvalue() == expected.encode("utf-8")
+    assert (count, written) == (100, len(expected))
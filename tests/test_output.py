@@ -0,0 +1,121 @@
+import json
+
+import pydantic
+import pytest
+
+from memory import MemoryBudget, SpillBuffer, write_json
+from output import (
+    CoordinateSizes,
+    OutputOptions,
+    decode_body,
+    encoded_writer,
+    output_options_from_env,
+    quantization_transform,
+    quantize_coordinates,
+    zstandard,
+)
+from plot import iter_features
+
+
+def test_quantize_to_decimal_places():
+    coords = [(0.9166666667, 19.1), (None, 5.0)]
+
+    quantized = list(quantize_coordinates(coords, OutputOptions(precision=3)))
+
+    assert quantized == [(0.917, 19.1), (None, 5.0)]
+
+
+def test_full_precision():
+    coords = [(0.9166666667, 19.1)]
+
+    quantized = list(quantize_coordinates(coords, OutputOptions(precision=None)))
+
+    assert quantized == coords
+
+
+def test_integer_quantization_round_trip():
+    options = OutputOptions(precision=4, integer_quantization=True)
+    lat, lon = 40.09325, -122.22687
+
+    [(qlat, qlon)] = quantize_coordinates([(lat, lon)], options)
+    transform = quantization_transform(options)
+
+    assert isinstance(qlat, int) and isinstance(qlon, int)
+    decoded_lon = qlon * transform["scale"][0] + transform["translate"][0]
+    decoded_lat = qlat * transform["scale"][1] + transform["translate"][1]
+    assert decoded_lon == pytest.approx(lon, abs=1e-4)
+    assert decoded_lat == pytest.approx(lat, abs=1e-4)
+
+
+@pytest.mark.parametrize(
+    "encoding",
+    [
+        "identity",
+        "gzip",
+        pytest.param(
+            "zstd",
+            marks=pytest.mark.skipif(
+                zstandard is None, reason="zstandard not installed"
+            ),
+        ),
+    ],
+)
+def test_encoded_writer_round_trip(encoding):
+    content = {"features": [{"id": i, "value": i % 7} for i in range(500)]}
+    buffer = SpillBuffer(MemoryBudget(limit=1024 * 1024), "output")
+
+    with encoded_writer(buffer, encoding) as writer:
+        json_size = write_json(content, writer)
+
+    body = buffer.getvalue()
+    assert json_size == len(json.dumps(content))
+    if encoding != "identity":
+        assert len(body) < json_size
+    assert json.loads(decode_body(body, encoding)) == content
+
+
+def test_decode_body_that_was_already_decoded():
+    assert decode_body(b'{"a": 1}', "gzip") == b'{"a": 1}'
+
+
+def test_output_options_from_env(monkeypatch):
+    assert output_options_from_env() == OutputOptions()
+
+    monkeypatch.setenv("MAP_AGENT_COORDINATE_PRECISION", "full")
+    monkeypatch.setenv("MAP_AGENT_CONTENT_ENCODING", "gzip")
+    assert output_options_from_env() == OutputOptions(precision=None, encoding="gzip")
+
+    monkeypatch.setenv("MAP_AGENT_INTEGER_COORDINATES", "1")
+    with pytest.raises(ValueError):
+        output_options_from_env()
+
+    monkeypatch.setenv("MAP_AGENT_CONTENT_ENCODING", "brotli")
+    with pytest.raises(pydantic.ValidationError):
+        output_options_from_env()
+
+
+@pytest.mark.parametrize(
+    "precision,expected",
+    [
+        (2, [1.99, 0.12]),
+        (8, [1.98765432, 0.12345679]),
+        (None, [1.9876543219, 0.1234567891]),
+    ],
+)
+def test_rendered_coordinates_keep_configured_precision(precision, expected):
+    coords = [(0.1234567891, 1.9876543219)]
+
+    features = iter_features(
+        quantize_coordinates(coords, OutputOptions(precision=precision))
+    )
+
+    assert next(features)["geometry"]["coordinates"] == expected
+
+
+def test_coordinate_sizes():
+    coords = [(0.1234567891, 1.9876543219), (None, 3.0)]
+    sizes = CoordinateSizes()
+
+    list(quantize_coordinates(coords, OutputOptions(precision=2), sizes))
+
+    assert sizes == CoordinateSizes(original=24, quantized=8)
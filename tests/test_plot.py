@@ -5,7 +5,7 @@ import pytest
 
 from conftest import resource
 from plot import make_validated_response_model, PropertyPaths, render_points_as_geojson
-from plot import read_path, select_properties
+from plot import read_path, read_coordinates, select_properties
 from util import extract_json_schema
 
 
@@ -185,3 +185,39 @@ def test_render_points_as_geojson():
         ],
         "type": "FeatureCollection",
     }
+
+
+def test_read_coordinates_from_combined_property():
+    data = {
+        "items": [
+            {"data": {"dwc:verbatimCoordinates": "23.075, -99.225"}},
+            {"data": {"dwc:verbatimCoordinates": "40°05'N 99°13'W"}},
+            {"data": {}},
+        ]
+    }
+
+    paths = PropertyPaths(
+        latitude=["items", "data", "dwc:verbatimCoordinates"],
+        longitude=["items", "data", "dwc:verbatimCoordinates"],
+        color_by=None,
+    )
+
+    lats, lons, report = read_coordinates(data, paths)
+
+    assert lats == [23.075, pytest.approx(40 + 5 / 60), None]
+    assert lons == [-99.225, pytest.approx(-(99 + 13 / 60)), None]
+    assert report.model_dump() == {
+        "parsed": 4,
+        "repaired": 2,
+        "rejected": 0,
+        "missing": 2,
+    }
+
+
+def test_render_points_with_start_id():
+    geo = render_points_as_geojson(
+        coordinates=[(53.1, 10.7), (None, None), (59.5, 70.0)],
+        start_id=100,
+    )
+
+    assert [feature["id"] for feature in geo["features"]] == [100, 102]
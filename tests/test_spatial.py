@@ -0,0 +1,74 @@
+import random
+
+import pydantic
+import pytest
+
+from spatial import (
+    BoundingBox,
+    FilterReport,
+    Polygon,
+    filter_points,
+    in_bbox,
+    in_polygon,
+)
+
+# A concave "C" shape with a square hole in its lower arm
+C_SHAPE = Polygon(
+    coordinates=[
+        [(0, 0), (10, 0), (10, 3), (3, 3), (3, 7), (10, 7), (10, 10), (0, 10)],
+        [(5, 1), (6, 1), (6, 2), (5, 2)],
+    ]
+)
+
+
+def test_bbox_validation():
+    with pytest.raises(pydantic.ValidationError):
+        BoundingBox(west=0, south=10, east=10, north=0)
+
+    with pytest.raises(pydantic.ValidationError):
+        Polygon(coordinates=[[(0, 0), (1, 1)]])
+
+
+def test_bbox_across_antimeridian():
+    bbox = BoundingBox(west=170, south=-10, east=-170, north=10)
+
+    assert in_bbox(0, 175, bbox)
+    assert in_bbox(0, -175, bbox)
+    assert not in_bbox(0, 0, bbox)
+    assert not in_bbox(20, 175, bbox)
+
+
+def test_in_polygon():
+    assert in_polygon(1, 5, C_SHAPE)
+    assert not in_polygon(5, 5, C_SHAPE)  # In the gap of the C
+    assert not in_polygon(5.5, 1.5, C_SHAPE)  # In the hole
+    assert in_polygon(8, 1.5, C_SHAPE)
+    assert not in_polygon(-1, 5, C_SHAPE)
+
+
+def test_filter_points_matches_exact_test():
+    rng = random.Random(0)
+    lons = [rng.uniform(-2, 12) for _ in range(5000)]
+    lats = [rng.uniform(-2, 12) for _ in range(5000)]
+
+    report = FilterReport()
+    kept = list(filter_points(zip(lats, lons), C_SHAPE, report))
+
+    expected = [in_polygon(lon, lat, C_SHAPE) for lat, lon in zip(lats, lons)]
+    assert [lat is not None for lat, _ in kept] == expected
+    assert [lon is not None for _, lon in kept] == expected
+    assert report.inside == sum(expected)
+    assert report.outside == len(expected) - sum(expected)
+    assert report.grid_decided > report.exact_tests
+
+
+def test_filter_points_keeps_positions():
+    lats = [20.0, None, 40.0, 21.0]
+    lons = [-100.0, -100.0, -100.0, None]
+    mexico = BoundingBox(west=-118.4, south=14.5, east=-86.7, north=32.7)
+
+    report = FilterReport()
+    kept = list(filter_points(zip(lats, lons), mexico, report))
+
+    assert kept == [(20.0, -100.0), (None, None), (None, None), (None, None)]
+    assert (report.inside, report.outside, report.missing) == (1, 1, 2)
@@ -0,0 +1,205 @@
+import gzip
+import json
+
+import ichatbio.types
+import pytest
+
+from conftest import RecordingProcess, resource
+from deadline import Deadline
+from memory import MemoryBudget, MemoryBudgetExceeded
+from output import zstandard
+from util import (
+    orjson,
+    read_local_json,
+    resolve_local_path,
+    retrieve_artifact_content,
+)
+
+
+def make_artifact(*uris, metadata=None) -> ichatbio.types.Artifact:
+    return ichatbio.types.Artifact(
+        local_id="#0000",
+        description="na",
+        mimetype="application/json",
+        uris=list(uris),
+        metadata=metadata or {},
+    )
+
+
+def test_resolve_file_uri(tmp_path):
+    path = tmp_path / "my artifact.json"
+    mounts = {"https://storage.test/artifacts/": tmp_path}
+
+    assert resolve_local_path(path.as_uri(), mounts) == path
+    assert resolve_local_path("file://elsewhere/data.json", mounts) is None
+    assert resolve_local_path("https://artifact.test/data.json", mounts) is None
+
+
+def test_resolve_file_uri_outside_mounts(tmp_path):
+    mounts = {"https://storage.test/artifacts/": tmp_path / "artifacts"}
+
+    assert resolve_local_path("file:///etc/passwd", {}) is None
+    assert resolve_local_path("file:///etc/passwd", mounts) is None
+    assert resolve_local_path((tmp_path / "secret.json").as_uri(), mounts) is None
+    assert (
+        resolve_local_path(
+            f"{(tmp_path / 'artifacts').as_uri()}/../secret.json", mounts
+        )
+        is None
+    )
+
+
+def test_resolve_mounted_url(tmp_path):
+    mounts = {"https://storage.test/artifacts/": tmp_path}
+
+    assert (
+        resolve_local_path("https://storage.test/artifacts/a/b%20c.json?v=1", mounts)
+        == tmp_path / "a" / "b c.json"
+    )
+    assert (
+        resolve_local_path("https://storage.test/artifacts/../secret", mounts) is None
+    )
+    assert resolve_local_path("https://storage.test/other/data.json", mounts) is None
+
+
+def test_read_local_json(tmp_path):
+    content = json.loads(resource("list_of_lat_lon_strings.json"))
+    plain = tmp_path / "plain.json"
+    plain.write_text(json.dumps(content))
+    compressed = tmp_path / "compressed.json.gz"
+    compressed.write_bytes(gzip.compress(json.dumps(content).encode("utf-8")))
+
+    assert read_local_json(plain) == content
+    assert read_local_json(compressed, "gzip") == content
+
+
+@pytest.fixture
+def mounted(tmp_path, monkeypatch):
+    monkeypatch.setenv(
+        "MAP_AGENT_LOCAL_MOUNTS", f"https://storage.test/artifacts/={tmp_path}"
+    )
+    return tmp_path
+
+
+@pytest.mark.asyncio
+async def test_retrieve_local_artifact(mounted, tmp_path):
+    path = tmp_path / "artifact.json"
+    path.write_text(resource("list_of_lat_lons.json"))
+    process = RecordingProcess()
+
+    content = await retrieve_artifact_content(
+        make_artifact("https://artifact.test", path.as_uri()), process
+    )
+
+    assert content == json.loads(resource("list_of_lat_lons.json"))
+    assert process.logs == ["Reading artifact content from a locally mounted file"]
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url
+    == "https://storage.test/artifacts/missing.json"
+)
+@pytest.mark.asyncio
+async def test_fall_back_to_http(tmp_path, monkeypatch, httpx_mock):
+    monkeypatch.setenv(
+        "MAP_AGENT_LOCAL_MOUNTS", f"https://storage.test/artifacts/={tmp_path}"
+    )
+    url = "https://storage.test/artifacts/missing.json"
+    httpx_mock.add_response(url=url, text=resource("list_of_lat_lons.json"))
+    process = RecordingProcess()
+
+    content = await retrieve_artifact_content(make_artifact(url), process)
+
+    assert content == json.loads(resource("list_of_lat_lons.json"))
+    assert process.logs == [f"Retrieving artifact content from {url}"]
+
+
+@pytest.mark.asyncio
+async def test_no_local_parse_after_deadline(mounted, tmp_path):
+    path = tmp_path / "artifact.json"
+    path.write_text(resource("list_of_lat_lons.json"))
+
+    with pytest.raises(TimeoutError):
+        await retrieve_artifact_content(
+            make_artifact(path.as_uri()), RecordingProcess(), deadline=Deadline(0)
+        )
+
+
+@pytest.mark.skipif(orjson is None, reason="orjson not installed")
+@pytest.mark.asyncio
+async def test_map_local_file_larger_than_budget(mounted, tmp_path):
+    path = tmp_path / "artifact.json"
+    path.write_text(resource("list_of_lat_lons.json"))
+    budget = MemoryBudget(limit=path.stat().st_size // 2)
+
+    content = await retrieve_artifact_content(
+        make_artifact(path.as_uri()), RecordingProcess(), budget
+    )
+
+    # The mapped file is parsed in place, so nothing but the parsed content is left to charge
+    assert content == json.loads(resource("list_of_lat_lons.json"))
+    assert budget.used == 0
+
+
+@pytest.mark.skipif(orjson is not None, reason="orjson parses the file in place")
+@pytest.mark.asyncio
+async def test_charge_text_copy_of_local_file(mounted, tmp_path):
+    path = tmp_path / "artifact.json"
+    path.write_text(resource("list_of_lat_lons.json"))
+
+    with pytest.raises(MemoryBudgetExceeded):
+        await retrieve_artifact_content(
+            make_artifact(path.as_uri()),
+            RecordingProcess(),
+            MemoryBudget(limit=path.stat().st_size - 1),
+        )
+
+
+@pytest.mark.parametrize(
+    "encoding,compress",
+    [
+        ("gzip", gzip.compress),
+        pytest.param(
+            "zstd",
+            lambda body: zstandard.ZstdCompressor().compress(body),
+            marks=pytest.mark.skipif(
+                zstandard is None, reason="zstandard not installed"
+            ),
+        ),
+    ],
+)
+def test_charge_only_decompressed_local_content(tmp_path, encoding, compress):
+    body = json.dumps([[23.075, -99.225]] * 1000).encode("utf-8")
+    path = tmp_path / "artifact.json"
+    path.write_bytes(compress(body))
+    budget = MemoryBudget(limit=len(body))
+
+    assert read_local_json(path, encoding, budget) == [[23.075, -99.225]] * 1000
+    assert budget.used == len(body)
+
+    with pytest.raises(MemoryBudgetExceeded):
+        read_local_json(path, encoding, MemoryBudget(limit=len(body) - 1))
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test"
+)
+@pytest.mark.asyncio
+async def test_file_uri_outside_mounts_goes_to_http(tmp_path, monkeypatch, httpx_mock):
+    monkeypatch.setenv(
+        "MAP_AGENT_LOCAL_MOUNTS",
+        f"https://storage.test/artifacts/={tmp_path / 'mounted'}",
+    )
+    outside = tmp_path / "outside.json"
+    outside.write_text(resource("list_of_lat_lon_strings.json"))
+    httpx_mock.add_response(
+        url="https://artifact.test", text=resource("list_of_lat_lons.json")
+    )
+    process = RecordingProcess()
+
+    content = await retrieve_artifact_content(
+        make_artifact(outside.as_uri(), "https://artifact.test"), process
+    )
+
+    assert content == json.loads(resource("list_of_lat_lons.json"))
+    assert process.logs == ["Retrieving artifact content from https://artifact.test"]